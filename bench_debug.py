@@ -0,0 +1,78 @@
+import os
+import time
+import logging
+import argparse
+
+import fs_ntfs.ntfs
+import fs_ntfs.helper
+import fs_ntfs.DataModel
+
+# cost of debug logging: the same $MFT scan and path lookups, with set_debug(True)
+# (every message formatted and written, to os.devnull) and with set_debug(False).
+# the data model page cache and the decoded runlists are shared by both modes, they
+# are warmed up by an untimed pass first, so only the parsing and logging differ
+
+
+def arg_options():
+
+    usage = """Usage: bench_debug.py ntfs_image
+       bench_debug.py ntfs_image --repeat 5 --lazy
+       bench_debug.py ntfs_image -s "Windows\\notepad.exe" -s "Windows\\System32"
+       """
+
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, epilog=usage)
+    parser.add_argument("image", help="NTFS files-system image.")
+
+    parser.add_argument("-r", "--repeat", help="Runs of each mode, the best one is reported.", type=int, default=3)
+    parser.add_argument("-s", "--search", help="Path looked up after the scan (can be repeated).", action="append", default=[])
+    parser.add_argument("--lazy", help="Scan with lazy file records.", action="store_true")
+
+    return parser.parse_args()
+
+def scan(ntfs, paths, lazy):
+    # one pass: every file record of the $MFT, then the path lookups. parsed records
+    # are dropped first, I/O caches (pages, runlists) stay warm
+    ntfs.mft.invalidate_cache()
+
+    start = time.perf_counter()
+
+    n = 0
+    for file_record in ntfs.mft.iter_file_records(lazy=lazy):
+        file_record.get_displayed_filename()
+        n += 1
+
+    for path in paths:
+        ntfs.mft.get_filerecord_of_path(path)
+
+    return time.perf_counter() - start, n
+
+def main():
+    args = arg_options()
+
+    # messages are formatted like with a log file, but nothing is kept
+    logging.basicConfig(handlers=[logging.FileHandler(os.devnull, 'w', 'utf-8')], level=logging.DEBUG)
+
+    image = args.image.strip('"')
+
+    ntfs = fs_ntfs.ntfs.NTFS(fs_ntfs.DataModel.FileDataModel(image))
+
+    # warm up the I/O caches, not timed
+    fs_ntfs.helper.Helper.set_debug(False)
+    scan(ntfs, args.search, args.lazy)
+
+    results = {}
+    for debug in (True, False):
+        fs_ntfs.helper.Helper.set_debug(debug)
+
+        runs = [scan(ntfs, args.search, args.lazy) for k in range(max(1, args.repeat))]
+        results[debug] = min(runs)
+
+    for debug in (True, False):
+        elapsed, n = results[debug]
+        print('set_debug({}): {} file records in {:.3f} s ({:.1f} us/record)'.format(debug, n, elapsed, elapsed * 1e6 / max(1, n)))
+
+    print('debug logging overhead: {:.1f}x'.format(results[True][0] / max(results[False][0], 1e-9)))
+    return
+
+if __name__ == '__main__':
+    main()
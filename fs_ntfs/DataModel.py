@@ -1,17 +1,33 @@
 import mmap
 import os
+import struct
+import threading
+
+from . import helper
+
+# precompiled little-endian accessors
+QWORD = struct.Struct('<Q')
+DWORD = struct.Struct('<I')
+WORD  = struct.Struct('<H')
+BYTE  = struct.Struct('<B')
 
 class DataModel(object):
     def __init__(self, data):
         self.data = data
 
-    def getQWORD(self, offset, asString=False):
-        if offset + 8 > self.size():
+    def unpack(self, fmt, offset):
+        # decode a whole fixed layout in one call, fmt is a precompiled struct.Struct
+        if offset < 0 or offset + fmt.size > self.size():
             return None
 
-        b = bytearray(self.data[offset:offset+8])
+        return fmt.unpack_from(self.data, offset)
+
+    def getQWORD(self, offset, asString=False):
+        d = self.unpack(QWORD, offset)
+        if d is None:
+            return None
 
-        d = ((b[7] << 56) | (b[6] << 48) | (b[5] << 40) | (b[4] << 32) | (b[3] << 24) | (b[2] << 16) | (b[1] << 8) | (b[0])) & 0xFFFFFFFFFFFFFFFF
+        d = d[0]
 
         if not asString:        
             return d
@@ -21,12 +37,11 @@ class DataModel(object):
         return s
 
     def getDWORD(self, offset, asString=False):
-        if offset + 4 >= self.size():
+        d = self.unpack(DWORD, offset)
+        if d is None:
             return None
 
-        b = bytearray(self.data[offset:offset+4])
-
-        d = ((b[3] << 24) | (b[2] << 16) | (b[1] << 8) | (b[0])) & 0xFFFFFFFF
+        d = d[0]
 
         if not asString:        
             return d
@@ -36,12 +51,11 @@ class DataModel(object):
         return s
 
     def getWORD(self, offset, asString=False):
-        if offset + 2 > self.size():
+        d = self.unpack(WORD, offset)
+        if d is None:
             return None
 
-        b = bytearray(self.data[offset:offset+2])
-
-        d = ((b[1] << 8) | (b[0])) & 0xFFFF
+        d = d[0]
 
         if not asString:        
             return d
@@ -51,12 +65,11 @@ class DataModel(object):
         return s
 
     def getBYTE(self, offset, asString=False):
-        if offset + 1 > self.size():
+        d = self.unpack(BYTE, offset)
+        if d is None:
             return None
 
-        b = bytearray(self.data[offset:offset+1])
-
-        d = (b[0]) & 0xFF
+        d = d[0]
 
         if not asString:        
             return d
@@ -77,6 +90,12 @@ class DataModel(object):
     def getStream(self, start, end):
         return bytearray(self.data[start:end])
 
+    def readinto(self, offset, buffer):
+        # fill buffer from offset, returns the number of bytes read (short at the end of data)
+        n = max(0, min(len(buffer), self.size() - offset))
+        buffer[:n] = self.data[offset:offset + n]
+        return n
+
     def getData(self):
         return self.data
 
@@ -96,11 +115,32 @@ class DataModel(object):
     def size(self):
         return len(self.data)
 
+# page cache defaults for FileDataModel
+PAGE_SIZE  = 0x10000
+CACHE_SIZE = 64 * 1024 * 1024
+
 class Slice(object):
-    def __init__(self, fo, size):
+    # read only view of a file, by offset. reads use os.pread()/os.preadv() where the OS has
+    # them: no shared file position, so threads share one file descriptor without locking
+    # and the GIL is released while reading. elsewhere (windows) seek + read under a lock.
+    def __init__(self, fo, size, page_size=PAGE_SIZE, cache_size=CACHE_SIZE):
         self._fo = fo
         self._size = size
 
+        self._fd = fo.fileno()
+        self._pread = hasattr(os, 'pread')
+        self._preadv = hasattr(os, 'preadv')
+
+        # fallback only, seek + read on the shared file object must not interleave
+        self._lock = threading.Lock()
+
+        # pages are aligned to page_size, keep it a multiple of the sector size
+        self._page_size = page_size
+        self._pages = None
+
+        if cache_size:
+            self._pages = helper.LRUCache(max_bytes=cache_size)
+
     def __len__(self):
         return self._size
 
@@ -108,6 +148,38 @@ class Slice(object):
         start = _slice.start
         stop  = _slice.stop
 
+        if self._pages is None or stop - start > self._page_size:
+            # big reads do not pollute the cache
+            return self._read(start, stop)
+
+        page_size = self._page_size
+
+        first = start // page_size
+        last  = (stop - 1) // page_size
+
+        if first == last:
+            # usual case, everything is in one page
+            page = self._get_page(first)
+            return page[start - first * page_size:stop - first * page_size]
+
+        result = bytearray()
+        for k in range(first, last + 1):
+            page = self._get_page(k)
+
+            page_start = k * page_size
+            result += page[max(start, page_start) - page_start:min(stop, page_start + page_size) - page_start]
+
+        return memoryview(result)
+
+    def _get_page(self, k):
+        page = self._pages.get(k)
+        if page is None:
+            page = self._read(k * self._page_size, (k + 1) * self._page_size)
+            self._pages.put(k, page, len(page))
+
+        return page
+
+    def _read(self, start, stop):
         # seek to sector
         # assume 0x200 bytes/sector
         bytes_per_sector = 0x200
@@ -115,16 +187,77 @@ class Slice(object):
         sectors = start // bytes_per_sector
 
         which_sector = sectors * bytes_per_sector
-        self._fo.seek(which_sector)
 
-        # careful for big data
-        result = bytearray(self._fo.read(stop - which_sector))
-        
+        if self._pread:
+            data = os.pread(self._fd, stop - which_sector, which_sector)
+
+            if 0 < len(data) < stop - which_sector:
+                # short read, large requests are split by the OS
+                data = bytearray(data)
+                while len(data) < stop - which_sector:
+                    more = os.pread(self._fd, stop - which_sector - len(data), which_sector + len(data))
+                    if not more:
+                        break
+
+                    data += more
+
+            # memoryview, so we do not copy again when skipping the sector prefix
+            result = memoryview(data)
+        else:
+            with self._lock:
+                self._fo.seek(which_sector)
+
+                # careful for big data
+                # memoryview, so we do not copy again when skipping the sector prefix
+                result = memoryview(self._fo.read(stop - which_sector))
+
         result = result[start-which_sector:]
         return result
 
+    def readinto(self, start, buffer):
+        # big reads straight into the caller's buffer, no page cache and no copy.
+        # raw devices need sector aligned offsets, unaligned reads go through _read()
+        bytes_per_sector = 0x200
+
+        view = memoryview(buffer)
+
+        if start % bytes_per_sector or (self._pread and not self._preadv):
+            data = self._read(start, start + len(view))
+            view[:len(data)] = data
+            return len(data)
+
+        done = 0
+
+        if self._preadv:
+            while done < len(view):
+                n = os.preadv(self._fd, [view[done:]], start + done)
+                if not n:
+                    break
+
+                done += n
+
+            return done
+
+        with self._lock:
+            self._fo.seek(start)
+
+            while done < len(view):
+                n = self._fo.readinto(view[done:])
+                if not n:
+                    break
+
+                done += n
+
+        return done
+
+    def cache_stats(self):
+        if self._pages is None:
+            return None
+
+        return self._pages.stats()
+
 class FileDataModel(DataModel):
-    def __init__(self, filename):
+    def __init__(self, filename, page_size=PAGE_SIZE, cache_size=CACHE_SIZE):
         self._filename = filename
         self._fo = open(filename, "rb")
 
@@ -136,10 +269,29 @@ class FileDataModel(DataModel):
             # ugly hack
             self._size = 8000000000*1024*1024*1024
 
-        self.data = Slice(self._fo, self._size)
+        # small reads (headers, file records, index records) are served from a page cache
+        self.data = Slice(self._fo, self._size, page_size, cache_size)
 
         super(FileDataModel, self).__init__(self.data)
 
+    @property
+    def source(self):
+        return self._filename
+
+    def unpack(self, fmt, offset):
+        if offset < 0 or offset + fmt.size > self.size():
+            return None
+
+        return fmt.unpack_from(self.data[offset:offset + fmt.size])
+
+    def readinto(self, offset, buffer):
+        n = max(0, min(len(buffer), self.size() - offset))
+        return self.data.readinto(offset, memoryview(buffer)[:n])
+
+    def cache_stats(self):
+        # hits/misses/evictions of the page cache, None if disabled
+        return self.data.cache_stats()
+
     def size(self):
         return self._size
 
@@ -151,6 +303,7 @@ class MappedFileDataModel(DataModel):
 
         # memory-map the file, size 0 means whole file
         self._mapped = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_COPY)
+        self._size = len(self._mapped)
 
         super(MappedFileDataModel, self).__init__(self._mapped)
 
@@ -174,12 +327,22 @@ class MappedFileDataModel(DataModel):
         self._mapped.close()
         self._f.close()
 
+    def readinto(self, offset, buffer):
+        # copied once, straight from the mapping
+        n = max(0, min(len(buffer), self._size - offset))
+
+        with memoryview(self._mapped) as mapped:
+            buffer[:n] = mapped[offset:offset + n]
+
+        return n
+
     def write(self, offset, stream):
-        self._mapped.seek(offset)
-        self._mapped.write(stream)
+        # slice assignment, the mmap position is left alone
+        self._mapped[offset:offset + len(stream)] = stream
 
     def size(self):
-        return os.path.getsize(self._filename)
+        # do not stat() the file on every field access
+        return self._size
 
 class MyByte(bytearray):
     def __init__(self, data):
@@ -1,11 +1,34 @@
+import bisect
 import collections
+import logging
+import struct
 
 from . import helper
+from . import bitmap
 from . import DataModel
+from . import datastream
 from . import indexes
 from . import filerecord
 from . import ntfs
 
+# standard attribute header, then the resident/non-resident part found at +0x10
+ATTRIBUTE_HEADER    = struct.Struct('<IIBBHHH')
+RESIDENT_HEADER     = struct.Struct('<IHBB')
+NON_RESIDENT_HEADER = struct.Struct('<QQHHIQQQ')
+
+# non-resident streams are returned in chunks of up to this size by get_data()
+DATA_CHUNK_SIZE = 100 * 1024 * 1024
+
+# in use INDX blocks of a directory are read in pieces of up to this size
+INDEX_READ_CHUNK = 4 * 1024 * 1024
+
+# index VCNs count 512 byte blocks when index records are smaller than a cluster
+INDEX_BLOCK_SIZE = 0x200
+
+# holes of sparse streams are returned in chunks of this size
+SPARSE_CHUNK = 1024 * 1024
+ZERO_BLOCK   = bytes(SPARSE_CHUNK)
+
 class AttrDefEntry(object):
     def __init__(self, a, t, f):
         self._a = a
@@ -54,6 +77,25 @@ class Attribute(object):
         self.ao = ao # stream offset
         self.std_header = AttributeStandardHeader()
 
+        # non-resident only, mapping pairs are decoded on first access
+        self._data_runs = None
+        self._data_runs_stream = None
+
+    def set_data_runs_stream(self, mft, start, end):
+        self._data_runs_stream = (mft, start, end)
+
+    @property
+    def data_runs(self):
+        if self._data_runs is None and self._data_runs_stream is not None:
+            mft, start, end = self._data_runs_stream
+            self._data_runs = mft._decode_data_runs(self.data.getStream(start, end))
+
+        return self._data_runs
+
+    @data_runs.setter
+    def data_runs(self, data_runs):
+        self._data_runs = data_runs
+
     def is_non_resident(self):
         try:
             return self.std_header.non_resident_flag
@@ -80,30 +122,131 @@ class Attribute_TYPES(object):
     def postprocess(self):
         pass
 
-    def _get_datarun_of_vcn(self, vcn, data_runs):
+    def _init_stream(self, attribute, file_record):
+        # attributes holding a stream ($DATA, $BITMAP), read with get_data()
+        log = helper.Helper.logger()
+
+        data = attribute.data
+        ao   = attribute.ao
 
-        k = 0
-        for data_run in data_runs:
+        self.attribute = attribute
+        self.file_record = file_record
+
+        if not attribute.std_header.non_resident_flag:
+            # is resident
+
+            ao = ao + attribute.std_header.offset_to_attribute
             
-            # file data model from our attribute
-            data = self.attribute.data
+            self.blob = data.getStream(ao, ao + attribute.std_header.length)
+            
+            log.debug('data is contained in attribute, %s bytes.', attribute.std_header.length)
+            #log.debug(blob)
 
+        if attribute.std_header.non_resident_flag and log.isEnabledFor(logging.DEBUG):
+            # is non resident, we have data runs
+
+            for data_run in attribute.data_runs:
+                n, lcn = data_run
+                if lcn is None:
+                    log.debug('0x%04x clusters, sparse', n)
+                    continue
+
+                file_offset = lcn * file_record.mft.sectors_per_cluster * file_record.mft.bytes_per_sector
+                size_in_bytes = n * file_record.mft.sectors_per_cluster * file_record.mft.bytes_per_sector
+
+                log.debug('DATA: 0x%04x clusters @ LCN 0x%08x, @ f_offset 0x%x, size_in_bytes %d', n, lcn, file_offset, size_in_bytes)
+
+        log.debug('')
+
+    def _data_extents(self, chunk_size):
+        # (volume offset, size) pieces of the stream, up to chunk_size bytes each,
+        # volume offset is None for holes of sparse streams
+        attribute = self.attribute
+        file_record = self.file_record
+
+        bytes_per_cluster = file_record.mft.sectors_per_cluster * file_record.mft.bytes_per_sector
+
+        size_of_data = attribute.std_header.attr_real_size
+
+        for data_run in attribute.data_runs:
             n, lcn = data_run
 
-            """
-            vcn: 1
-            clusters: 1a, 2b, 2c
-            -> 2b, vcn_rel: 0
-            """
+            file_offset = None
+            if lcn is not None:
+                file_offset = lcn * bytes_per_cluster
 
-            # vcn is in this data_run ?
-            if k <= vcn < k+n:
-                return data_run, vcn - k
+            # size in bytes is rounded-up to cluster size (could hide data)
+            size_in_bytes = n * bytes_per_cluster
 
-            k += n
+            # if the file is big, i guess one chunk is not rounded up
+            size_to_read = min(size_in_bytes, size_of_data)
 
-        return None
+            if size_of_data == 0:
+                # I do not know why we have $DATA with real size of zero, but contains data runs...
+                size_to_read = size_in_bytes
 
+            remains_to_read = size_to_read
+            while remains_to_read > 0:
+                to_read = min(remains_to_read, chunk_size)
+
+                yield file_offset, to_read
+
+                if file_offset is not None:
+                    file_offset += to_read
+
+                remains_to_read -= to_read
+
+            size_of_data -= size_to_read
+
+    def get_data(self, chunk_size=DATA_CHUNK_SIZE):
+        # the stream as freshly allocated chunks
+        attribute = self.attribute
+        dataModel = attribute.dataModel
+
+        if not attribute.std_header.non_resident_flag:
+            yield self.blob
+            return
+
+        for file_offset, size in self._data_extents(chunk_size):
+            if file_offset is None:
+                # hole in a sparse stream, zeros without touching the disk
+                yield from self._zeros(size)
+            else:
+                yield dataModel.getStream(file_offset, file_offset + size)
+
+    def get_data_into(self, buffer):
+        # the stream read chunk by chunk into buffer (a bytearray, reused), chunks are
+        # memoryviews over it and are only valid until the next one is asked for
+        attribute = self.attribute
+        file_record = self.file_record
+        dataModel = attribute.dataModel
+
+        if not attribute.std_header.non_resident_flag:
+            yield self.blob
+            return
+
+        view = memoryview(buffer)
+
+        # whole clusters, so reads stay sector aligned
+        bytes_per_cluster = file_record.mft.sectors_per_cluster * file_record.mft.bytes_per_sector
+        chunk_size = max(bytes_per_cluster, len(view) - len(view) % bytes_per_cluster)
+
+        if chunk_size > len(view):
+            raise ValueError('buffer is smaller than a cluster')
+
+        for file_offset, size in self._data_extents(chunk_size):
+            if file_offset is None:
+                yield from self._zeros(size)
+            else:
+                n = dataModel.readinto(file_offset, view[:size])
+                yield view[:n]
+
+    def _zeros(self, size):
+        # one shared zero block, sliced as needed
+        while size > 0:
+            chunk = min(size, SPARSE_CHUNK)
+            yield ZERO_BLOCK[:chunk] if chunk < SPARSE_CHUNK else ZERO_BLOCK
+            size -= chunk
 
     def _fetch_vcn(self, vcn, data_run_rel_vcn, datamodel):
         log = helper.Helper.logger()
@@ -111,19 +254,24 @@ class Attribute_TYPES(object):
 
         (n, lcn), rel_vcn = data_run_rel_vcn
 
-        log.debug('\t\tVCN relative to data-run: {}'.format(rel_vcn))
+        log.debug('\t\tVCN relative to data-run: %s', rel_vcn)
 
         bytes_per_cluster = self.file_record.mft.sectors_per_cluster * self.file_record.mft.bytes_per_sector
-        file_offset       = (lcn + rel_vcn) * self.file_record.mft.sectors_per_cluster * self.file_record.mft.bytes_per_sector
         #size_in_bytes     = n * self.file_record.mft.sectors_per_cluster * self.file_record.mft.bytes_per_sector
 
-        # only one vcn
-        # is it possible to have more than one cluster/entry ? !TODO
+        # one cluster at vcn, for a non-resident $ATTRIBUTE_LIST (see _fetch_vcns()).
+        # INDX blocks are read through _read_node() / _load_blocks()
         size_in_bytes     = 1 * self.file_record.mft.sectors_per_cluster * self.file_record.mft.bytes_per_sector
 
-        clusters = datamodel.getStream(file_offset, file_offset + size_in_bytes)
+        if lcn is None:
+            # sparse, nothing allocated on disk
+            log.debug('\t\tVCN: 0x%04x clusters, sparse', n)
+            clusters = bytes(size_in_bytes)
+        else:
+            file_offset = (lcn + rel_vcn) * bytes_per_cluster
+            clusters = datamodel.getStream(file_offset, file_offset + size_in_bytes)
 
-        log.debug('\t\tINDX: 0x{:04x} clusters @ LCN 0x{:04x}, @ f_offset 0x{:x}, size_in_bytes {}'.format(n, lcn, file_offset, size_in_bytes))
+            log.debug('\t\tVCN: 0x%04x clusters @ LCN 0x%04x, @ f_offset 0x%x, size_in_bytes %s', n, lcn, file_offset, size_in_bytes)
 
         # buffered data model
         data = DataModel.BufferDataModel(clusters, 'lcn')
@@ -149,86 +297,215 @@ class Attribute_INDEX_ROOT(Attribute_TYPES):
     def registered_for(cls, attr_type):
         return attr_type == 0x90
 
-    def _process_INDX(self, data, index_allocation_dataruns, iter_function):
+    def _INDX_header(self, data):
+        # check INDX block header and apply fixups, returns offset of the first index entry.
+        # None for a block without INDX magic (hole, zeroed or unused block), it has no entries
         log = helper.Helper.logger()
 
-        bytes_per_sector = self.file_record.mft.bytes_per_sector
-
         ofs = 0
 
         indx_magic = data.getStream(ofs, ofs + 4)
-        log.debug('Magic: {}'.format(indx_magic))
+        log.debug('Magic: %s', indx_magic)
 
         if indx_magic != b'INDX':
-            log.debug('Bad magic: {}, continue anyway with next data-run'.format(indx_magic))
-            
+            log.debug('Bad magic: %s, INDX block skipped.', indx_magic)
+            return None
 
-        self.vcn_idx_record = data.getQWORD(ofs + 16)
-        log.debug('VCN of this Index record in the Index Allocation: 0x{:0x}'.format(self.vcn_idx_record))
+        vcn_idx_record = data.getQWORD(ofs + 16)
+        log.debug('VCN of this Index record in the Index Allocation: 0x%0x', vcn_idx_record)
 
-        self.ofs_first_index_entry = data.getDWORD(ofs + 0x18 + 0x00)
-        self.total_size_of_index_entries = data.getDWORD(ofs + 0x18 + 0x04)
+        ofs_first_index_entry = data.getDWORD(ofs + 0x18 + 0x00)
+        total_size_of_index_entries = data.getDWORD(ofs + 0x18 + 0x04)
 
-        log.debug('Offset to first index entry: 0x{:0X}'.format(self.ofs_first_index_entry))
-        log.debug('Total size of index entries: 0x{:0X}'.format(self.total_size_of_index_entries))
+        log.debug('Offset to first index entry: 0x%0X', ofs_first_index_entry)
+        log.debug('Total size of index entries: 0x%0X', total_size_of_index_entries)
 
         size_update_seq = data.getWORD(ofs + 6)
-        log.debug('Size in words of Update Sequence: 0x{:0X}'.format(size_update_seq))
+        log.debug('Size in words of Update Sequence: 0x%0X', size_update_seq)
 
         update_seq = data.getWORD(ofs + 0x28)
-        log.debug('Update Sequence number: 0x{:04x}'.format(update_seq))
+        log.debug('Update Sequence number: 0x%04x', update_seq)
 
         update_seq_array = data.getStream(ofs + 0x2a, ofs + 0x2a + size_update_seq * 2)
 
-        g = 'Update Sequence: '
-        for x in update_seq_array:
-            g += '{:02x} '.format(x)
-            
-        log.debug('{}'.format(g))
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug('Update Sequence: %s', ' '.join('{:02x}'.format(x) for x in update_seq_array))
 
         # fixup things
         ntfs.NTFS.fixup_seq_numbers(data, update_seq_array, size_update_seq, update_seq, self.file_record.mft.bytes_per_sector)
 
-        self.non_leaf_node = data.getBYTE(ofs + 0x18 + 0x0c)
-        log.debug('Non-leaf node Flag (has sub-nodes): {}'.format(self.non_leaf_node))
+        non_leaf_node = data.getBYTE(ofs + 0x18 + 0x0c)
+        log.debug('Non-leaf node Flag (has sub-nodes): %s', non_leaf_node)
 
         log.debug('')
 
         #off = ofs + 0x58 # FIXME! calculat #0x2a + size_update_seq*2 - 2
 
         # ofs_first_index_entry is relative to 0x18 (documentation says this)
-        off = ofs + self.ofs_first_index_entry + 0x18
+        return ofs + ofs_first_index_entry + 0x18
+
+    def _process_INDX(self, vcn, iter_function):
+        log = helper.Helper.logger()
+
+        node = self._read_node(vcn)
+        if node is None:
+            return
+
+        data, off = node
 
-        log.debug('Iterating {} index...'.format(self.attribute.std_header.name))
+        log.debug('Iterating %s index...', self.attribute.std_header.name)
 
-        #nodes, entries = self._iterate_index_entries(data, off)
         nodes, entries = iter_function(data, off)
         if len(nodes) > 0:
-            log.debug('!!! We have {} nodes !!!'.format(len(nodes)))
+            log.debug('!!! We have %s nodes !!!', len(nodes))
 
         for node in nodes:
-            vcn = node.subnode_vcn
-            data_run = self._get_datarun_of_vcn(vcn, index_allocation_dataruns)
-
-            if data_run == None:
-                log.debug('VCN {} not found in data-run, exiting.'.format(vcn))
-                return
-
-            newdata = self._fetch_vcn(vcn, data_run, self.attribute.dataModel)
-            log.debug('+++ process b-tree node, vcn: 0x{:x}. +++'.format(vcn))
-            self._process_INDX(newdata, index_allocation_dataruns, iter_function)
+            log.debug('+++ process b-tree node, vcn: 0x%x. +++', node.subnode_vcn)
+            self._process_INDX(node.subnode_vcn, iter_function)
 
         # add entries
-        self.entries.extend(entries)
+        self._entries.extend(entries)
         log.debug('')
         return nodes
 
+    def _vcn_size(self):
+        # bytes per index VCN
+        bytes_per_cluster = self.file_record.mft.sectors_per_cluster * self.file_record.mft.bytes_per_sector
 
-    def postprocess(self):
+        if self.bytes_per_index_record >= bytes_per_cluster:
+            return bytes_per_cluster
+
+        return INDEX_BLOCK_SIZE
+
+    def _allocation_reader(self, allocations):
+        # one reader over all the $INDEX_ALLOCATION extents, see _index_allocations()
+        if self._reader is None:
+            self._reader = datastream.StreamReader(self.file_record, allocations)
+
+        return self._reader
+
+    def _read_node(self, vcn):
+        # (data model, offset of the first entry) of the INDX block at vcn, fixed up, None
+        # if there is no valid block there. from the blocks loaded by _load_blocks(), or read on its own
+        log = helper.Helper.logger()
+
+        if self._blocks is not None and vcn in self._blocks:
+            return self._blocks[vcn]
+
+        allocations = self._index_allocations()
+        if not allocations:
+            log.debug('We do not have $INDEX_ALLOCATION attribute, exiting.')
+            return None
+
+        offset = vcn * self._vcn_size()
+
+        reader = self._allocation_reader(allocations)
+        if offset >= reader.size:
+            log.debug('VCN %s not found in data-run, exiting.', vcn)
+            return None
+
+        block = bytearray(self.bytes_per_index_record)
+
+        reader.seek(offset)
+        reader.readinto(block)
+
+        log.debug('INDX: VCN 0x%x @ 0x%x in the index allocation', vcn, offset)
+
+        data = DataModel.BufferDataModel(block, 'INDX')
+
+        off = self._INDX_header(data)
+        if off is None:
+            return None
+
+        return data, off
+
+    def _index_bitmap(self):
+        # INDX blocks in use, from the $BITMAP of this index. None if there is none
+        bitmaps = self.file_record.get_attribute('$BITMAP')
+        if not bitmaps:
+            return None
+
+        for bits in bitmaps:
+            if bits.attribute.std_header.name == self.attribute.std_header.name:
+                return bits.get_bitset()
+
+        return None
+
+    def _load_blocks(self, allocations):
+        # every in use INDX block, read in coalesced sequential pieces and fixed up,
+        # before the b-tree is walked. blocks are kept in self._blocks by VCN
         log = helper.Helper.logger()
 
-        # file data model from our attribute
-        datamodel = self.attribute.dataModel
+        record_size = self.bytes_per_index_record
+        if record_size == 0:
+            return
+
+        vcn_size = self._vcn_size()
+
+        reader = self._allocation_reader(allocations)
+        n_blocks = reader.size // record_size
+
+        bits = self._index_bitmap()
+        if bits is None:
+            log.debug('index has no $BITMAP, reading all %s INDX blocks.', n_blocks)
+            extents = [(0, n_blocks)]
+        else:
+            extents = bits.extents(True, 0, n_blocks)
+
+        blocks_per_read = max(1, INDEX_READ_CHUNK // record_size)
+
+        self._blocks = {}
+        for first, n in extents:
+            while n > 0:
+                count = min(n, blocks_per_read)
+
+                buf = bytearray(count * record_size)
+
+                reader.seek(first * record_size)
+                reader.readinto(buf)
+
+                log.debug('INDX: %s blocks @ 0x%x in the index allocation', count, first * record_size)
+
+                for k in range(count):
+                    data = DataModel.BufferDataModel(buf[k * record_size:(k + 1) * record_size], 'INDX')
+                    off = self._INDX_header(data)
+
+                    # kept as None, so _read_node() does not read a bad block again
+                    self._blocks[(first + k) * record_size // vcn_size] = (data, off) if off is not None else None
+
+                first += count
+                n -= count
+
+    def _index_allocations(self):
+        # $INDEX_ALLOCATION attributes with the same name as this index. a big index is split
+        # in several of them (extension records, through $ATTRIBUTE_LIST), each with its VCNs
+        allocations = self.file_record.get_attribute('$INDEX_ALLOCATION')
+        if not allocations:
+            return []
+
+        name = self.attribute.std_header.name
+        return [allocation for allocation in allocations if allocation.attribute.std_header.name == name]
+
+    @property
+    def entries(self):
+        # all entries of the index, INDX blocks are read on first access
+        if self._entries is None:
+            self._entries = list(self.root_entries)
+            self._load_entries()
+
+            self.file_record.mft.update_cache_size(self.file_record)
+
+        return self._entries
+
+    def loaded_entries(self):
+        # entries currently in memory, nothing is read
+        if self._entries is None:
+            return self.root_entries
+
+        return self._entries
+
+    def _load_entries(self):
+        log = helper.Helper.logger()
 
         # check if we have sub-nodes from root
         if len(self.root_nodes) == 0:
@@ -236,46 +513,132 @@ class Attribute_INDEX_ROOT(Attribute_TYPES):
             return
 
         # check if we have $INDEX_ALLOCATION
-        if '$INDEX_ALLOCATION' not in self.file_record.attributes_dict:
+        allocations = self._index_allocations()
+        if not allocations:
             log.debug('We do not have $INDEX_ALLOCATION attribute, exiting.')
             return
 
-        index_allocation = self.file_record.attributes_dict['$INDEX_ALLOCATION'][0]
-
         # check if index type is registered
 
-        obj_index = indexes.IndexTypeFactory.recognize(index_allocation.attribute.std_header.name)
+        obj_index = indexes.IndexTypeFactory.recognize(self.attribute.std_header.name)
         if obj_index is None:
-            log.debug('!!! Index {} not supported yet. !!!'.format(index_allocation.attribute.std_header.name))
+            log.debug('!!! Index %s not supported yet. !!!', self.attribute.std_header.name)
             return
 
         # for debugging purpose
-        for data_run in index_allocation.attribute.data_runs:
-            
-            n, lcn = data_run
+        if log.isEnabledFor(logging.DEBUG):
+            for data_run in (data_run for allocation in allocations for data_run in allocation.attribute.data_runs):
 
-            file_offset = lcn * self.file_record.mft.sectors_per_cluster * self.file_record.mft.bytes_per_sector
-            size_in_bytes = n * self.file_record.mft.sectors_per_cluster * self.file_record.mft.bytes_per_sector
+                n, lcn = data_run
+                if lcn is None:
+                    log.debug('0x%04x clusters, sparse', n)
+                    continue
 
-            total_clusters_in_buffer = n
+                file_offset = lcn * self.file_record.mft.sectors_per_cluster * self.file_record.mft.bytes_per_sector
+                size_in_bytes = n * self.file_record.mft.sectors_per_cluster * self.file_record.mft.bytes_per_sector
 
-            log.debug('INDX: 0x{:04x} clusters @ LCN 0x{:04x}, @ f_offset 0x{:x}, size_in_bytes {}'.format(n, lcn, file_offset, size_in_bytes))
+                log.debug('INDX: 0x%04x clusters @ LCN 0x%04x, @ f_offset 0x%x, size_in_bytes %s', n, lcn, file_offset, size_in_bytes)
 
 
+        self._load_blocks(allocations)
+
         for node in self.root_nodes:
-            vcn = node.subnode_vcn
-            log.debug('Need VCN: 0x{:0x}'.format(vcn))
-            data_run = self._get_datarun_of_vcn(vcn, index_allocation.attribute.data_runs)
+            log.debug('Need VCN: 0x%0x', node.subnode_vcn)
 
-            if data_run == None:
-                log.debug('VCN {} not found in data-run, exiting.'.format(vcn))
+            # we should process INDX, recursively
+            self._process_INDX(node.subnode_vcn, obj_index.iterate_index_entries)
+
+        # entries are parsed, the blocks are not needed anymore
+        self._blocks = None
+
+    def _node_entries(self, vcn):
+        # entries of the b-tree node stored at vcn, in collation order
+        node = self._read_node(vcn)
+        if node is None:
+            return
+
+        log = helper.Helper.logger()
+        log.debug('+++ b-tree node, vcn: 0x%x. +++', vcn)
+
+        data, off = node
+        yield from self.obj_index.iter_node_entries(data, off)
+
+    def iter_entries(self):
+        # $I30 entries in collation order, walking the b-tree in order. INDX blocks are read
+        # one by one as the walk gets to them, only the current path is kept in memory
+        if self.attribute.std_header.name != '$I30':
+            return
+
+        root = self.obj_index.iter_node_entries(self.attribute.data, self._root_off)
+        yield from self._iter_node(root, set())
+
+    def _iter_node(self, node_entries, seen):
+        for entry in node_entries:
+            if entry.index_flags & 1:
+                vcn = entry.subnode_vcn
+
+                if vcn in seen:
+                    helper.Helper.logger().warning('b-tree node at VCN 0x%x seen twice, skipped.', vcn)
+                else:
+                    # keys of the sub-node sort before this entry
+                    seen.add(vcn)
+                    yield from self._iter_node(self._node_entries(vcn), seen)
+
+            if not entry.index_flags & 2:
+                yield entry
+
+    def find(self, name, upcase=None, ignore_case=False):
+        # $I30 lookup of name, returns the index entry, or None. see find_many()
+        return self.find_many([name], upcase, ignore_case).get(name)
+
+    def find_many(self, names, upcase=None, ignore_case=False):
+        # $I30 lookup of many names at once, descending the b-tree: only the INDX blocks
+        # on the search paths are read, each one once for the whole batch.
+        # keys collate through upcase (the volume $UpCase, see MFT.get_upcase_table()),
+        # names match exactly unless ignore_case. returns {name: index entry} of the names found
+        found = {}
+        if self.attribute.std_header.name != '$I30':
+            return found
+
+        pending = sorted(set((indexes.filename_key(name, upcase), name) for name in names))
+
+        root = self.obj_index.iter_node_entries(self.attribute.data, self._root_off)
+        self._find_in_node(root, pending, found, upcase, ignore_case)
+
+        return found
+
+    def _find_in_node(self, node_entries, pending, found, upcase, ignore_case):
+        # pending is sorted by key
+        for entry in node_entries:
+            if not pending:
                 return
 
-            data = self._fetch_vcn(vcn, data_run, datamodel)
+            if entry.index_flags & 2:
+                # last entry, everything left is in its sub-node
+                below, pending = pending, []
 
-            # we should process INDX, recursively
-            self._process_INDX(data, index_allocation.attribute.data_runs, obj_index.iterate_index_entries)
+            else:
+                entry_key = indexes.filename_key(entry.filename, upcase)
+
+                keys = [key for key, name in pending]
+                j = bisect.bisect_left(keys, entry_key)
+                k = bisect.bisect_right(keys, entry_key)
+
+                equal = []
+                for key, name in pending[j:k]:
+                    if ignore_case or entry.filename == name:
+                        found[name] = entry
+                    else:
+                        equal.append((key, name))
 
+                # names that collate equal but differ in case may be on both sides of this entry
+                below = pending[:j] + equal
+                pending = equal + pending[k:]
+
+            if below and entry.index_flags & 1:
+                self._find_in_node(self._node_entries(entry.subnode_vcn), below, found, upcase, ignore_case)
+
+                pending = [(key, name) for key, name in pending if name not in found]
 
     def __init__(self, attribute, file_record):
 
@@ -291,38 +654,47 @@ class Attribute_INDEX_ROOT(Attribute_TYPES):
 
         log = helper.Helper.logger()
 
-        log.debug('Attribute: {} (0x{:X})'.format(attribute.std_header.attrdef.name, attribute.std_header.attrdef.type))
+        log.debug('Attribute: %s (0x%X)', attribute.std_header.attrdef.name, attribute.std_header.attrdef.type)
 
         # index root attr
         self.bytes_per_index_record = data.getDWORD(ofs + 8)
-        log.debug('Bytes per Index Record: 0x{:0X}'.format(self.bytes_per_index_record))
+        log.debug('Bytes per Index Record: 0x%0X', self.bytes_per_index_record)
 
         self.clusters_per_index_record = data.getBYTE(ofs + 12)
-        log.debug('Clusters per Index Record: 0x{:0X}'.format(self.clusters_per_index_record))
+        log.debug('Clusters per Index Record: 0x%0X', self.clusters_per_index_record)
 
 
         self.index_header = indexes.IndexHeader()
         log.debug('-= index node header =-')
         # index node header
         self.index_header.ofs_first_index_entry = data.getDWORD(ofs + 16 + 0)
-        log.debug('Offset to first index entry: 0x{:0X}'.format(self.index_header.ofs_first_index_entry))
+        log.debug('Offset to first index entry: 0x%0X', self.index_header.ofs_first_index_entry)
 
         self.index_header.total_size_of_index_entries = data.getDWORD(ofs + 16 + 4)
-        log.debug('Total size of index entries: 0x{:0X}'.format(self.index_header.total_size_of_index_entries))
+        log.debug('Total size of index entries: 0x%0X', self.index_header.total_size_of_index_entries)
 
         self.index_header.index_flags = data.getBYTE(ofs + 16 + 0x0c)
-        log.debug('Large index (index allocation needed): {}'.format(self.index_header.index_flags))
+        log.debug('Large index (index allocation needed): %s', self.index_header.index_flags)
 
-        self.entries = []
+        # entries held in the root node; the whole index is loaded by the entries property
+        self.root_entries = []
+        self._entries = None
+
+        # INDX blocks by VCN while the index is loaded, reader over $INDEX_ALLOCATION
+        self._blocks = None
+        self._reader = None
 
         off = ofs + 16 + 16
+        self._root_off = off
         self.root_nodes = []
 
 
         # i'm not sure why in index_root, index type == $R, we actually have the format from $I30
         obj_index = indexes.IndexTypeFactory.recognize(attribute.std_header.name)
         if obj_index is None:
-            log.debug("!!! Index {} not supported. !!!".format(attribute.std_header.name))
+            log.debug("!!! Index %s not supported. !!!", attribute.std_header.name)
+
+        self.obj_index = obj_index
 
         if attribute.std_header.name == '$I30':
             # we support only this kind of index
@@ -333,15 +705,16 @@ class Attribute_INDEX_ROOT(Attribute_TYPES):
             nodes, entries = obj_index.iterate_index_entries(data, off)
 
         else:
-            log.debug("!!! Index {} not supported. !!!".format(attribute.std_header.name))
+            log.debug("!!! Index %s not supported. !!!", attribute.std_header.name)
             return
 
-        self.entries.extend(entries)
+        self.root_entries.extend(entries)
 
-        log.debug('We have {} sub-nodes:'.format(len(nodes)))
+        log.debug('We have %s sub-nodes:', len(nodes))
 
-        for node in nodes:
-            log.debug('sub-node with VCN: 0x{:x}'.format(node.subnode_vcn))
+        if log.isEnabledFor(logging.DEBUG):
+            for node in nodes:
+                log.debug('sub-node with VCN: 0x%x', node.subnode_vcn)
 
         self.root_nodes = nodes
 
@@ -353,86 +726,20 @@ class Attribute_DATA(Attribute_TYPES):
         return attr_type == 0x80
 
     def __init__(self, attribute, file_record):
-        log = helper.Helper.logger()
-
-        data = attribute.data
-        ao   = attribute.ao
-
-        self.attribute = attribute
-        self.file_record = file_record
-
-        if not attribute.std_header.non_resident_flag:
-            # is resident
-
-            ao = ao + attribute.std_header.offset_to_attribute
-            
-            self.blob = data.getStream(ao, ao + attribute.std_header.length)
-            
-            log.debug('data is contained in attribute, {} bytes.'.format(attribute.std_header.length))
-            #log.debug(blob)
-
-        if attribute.std_header.non_resident_flag:
-            # is non resident, we have data runs
-
-            for data_run in attribute.data_runs:
-                n, lcn = data_run
-
-                file_offset = lcn * file_record.mft.sectors_per_cluster * file_record.mft.bytes_per_sector
-                size_in_bytes = n * file_record.mft.sectors_per_cluster * file_record.mft.bytes_per_sector
-
-                log.debug('DATA: 0x{:04x} clusters @ LCN 0x{:08x}, @ f_offset 0x{:x}, size_in_bytes {:,}'.format(n, lcn, file_offset, size_in_bytes))
-
-        log.debug('')
-
-    def get_data(self):
-
-        attribute = self.attribute
-        file_record = self.file_record
-        dataModel = attribute.dataModel
-
-        blob = bytearray()
-
-        size_of_data = attribute.std_header.attr_real_size
-        if not attribute.std_header.non_resident_flag:
-            yield self.blob
-
-        if attribute.std_header.non_resident_flag:
-            for data_run in attribute.data_runs:
-                n, lcn = data_run
-
-                file_offset = lcn * file_record.mft.sectors_per_cluster * file_record.mft.bytes_per_sector
-                
-                # size in bytes is rounded-up to cluster size (could hide data)
-                size_in_bytes = n * file_record.mft.sectors_per_cluster * file_record.mft.bytes_per_sector
-
-                # if the file is big, i guess one chunk is not rounded up
-                size_to_read = min(size_in_bytes, size_of_data)
-
-                if size_of_data == 0:
-                    # I do not know why we have $DATA with real size of zero, but contains data runs...
-                    size_to_read = size_in_bytes
-
-                BIG = 100 * 1024 * 1024
-
-                remains_to_read = size_to_read
-                to_read = min(size_to_read, BIG)
-
-                while to_read <= remains_to_read:
-                    blob = dataModel.getStream(file_offset, file_offset + to_read)
-                    yield blob
-
-                    file_offset += to_read
-                    remains_to_read -= to_read
-
-                    if remains_to_read == 0:
-                        break
-
-                    to_read = min(remains_to_read, BIG)
+        self._init_stream(attribute, file_record)
 
+class Attribute_BITMAP(Attribute_TYPES):
+    @classmethod
+    def registered_for(cls, attr_type):
+        return attr_type == 0xB0
 
-                size_of_data -= size_to_read
+    def __init__(self, attribute, file_record):
+        # $BITMAP, of $MFT (records in use) or of an index (INDX blocks in use)
+        self._init_stream(attribute, file_record)
 
-            self.blob = blob
+    def get_bitset(self, size=None):
+        # whole bitmap as a bitmap.Bitset of size bits (all of them by default)
+        return bitmap.Bitset(b''.join(bytes(chunk) for chunk in self.get_data()), size)
 
 class Attribute_STANDARD_INFORMATION(Attribute_TYPES):
     @classmethod
@@ -458,10 +765,10 @@ class Attribute_REPARSE_POINT(Attribute_TYPES):
         ao   = attribute.ao + attribute.std_header.offset_to_attribute
 
         self.reparse_type = data.getDWORD(ao + 0x00)
-        log.debug('Reparse type and flags: 0x{:08X}'.format(self.reparse_type))
+        log.debug('Reparse type and flags: 0x%08X', self.reparse_type)
 
         self.data_length = data.getWORD(ao + 0x04)
-        log.debug('Reparse data length: 0x{:0X}'.format(self.data_length))
+        log.debug('Reparse data length: 0x%0X', self.data_length)
 
         # assume is symlink
 
@@ -474,8 +781,8 @@ class Attribute_REPARSE_POINT(Attribute_TYPES):
         p_len = data.getWORD(ao + 0x06)
 
 
-        log.debug('substitute offset 0x{:x}, len 0x{:x}'.format(s_off, s_len))
-        log.debug('print offset 0x{:x}, len 0x{:x}'.format(p_off, p_len))
+        log.debug('substitute offset 0x%x, len 0x%x', s_off, s_len)
+        log.debug('print offset 0x%x, len 0x%x', p_off, p_len)
 
         # documentation seems to be wrong about this ?!?!?
         ao += 0x8
@@ -491,11 +798,11 @@ class Attribute_REPARSE_POINT(Attribute_TYPES):
             buff = data.getStream(ao + s_off + 4, ao + s_off + s_len + 4)
 
         self.substitute_path = helper.Helper._widechar_to_ascii(buff)
-        log.debug('Substitute path: {}'.format(self.substitute_path))
+        log.debug('Substitute path: %s', self.substitute_path)
 
         buff = data.getStream(ao + p_off, ao + p_off + p_len)
         buff = helper.Helper._widechar_to_ascii(buff)
-        log.debug('Print path: {}'.format(buff))
+        log.debug('Print path: %s', buff)
 
 
         path_buffer = data.getStream(ao + 0x10, ao + 0x10 + self.data_length)
@@ -509,10 +816,10 @@ class Attribute_ATTRIBUTE_LIST(Attribute_TYPES):
     def _fetch_vcns(self, start_vcn, last_vcn, data_runs, datamodel):
         newdata = bytearray()
         for vcn in range(start_vcn, last_vcn + 1):
-            data_run = self._get_datarun_of_vcn(vcn, data_runs)
+            data_run = data_runs.find_vcn(vcn)
 
             if data_run == None:
-                log.warning('VCN {} not found in data-run, exiting.'.format(vcn))
+                log.warning('VCN %s not found in data-run, exiting.', vcn)
                 return
 
             newdata += self._fetch_vcn(vcn, data_run, datamodel).raw
@@ -536,13 +843,17 @@ class Attribute_ATTRIBUTE_LIST(Attribute_TYPES):
         if attribute.std_header.non_resident_flag:
             # attribute is non-residend, fetch it
 
-            for data_run in attribute.data_runs:
-                n, lcn = data_run
+            if log.isEnabledFor(logging.DEBUG):
+                for data_run in attribute.data_runs:
+                    n, lcn = data_run
+                    if lcn is None:
+                        log.debug('0x%04x clusters, sparse', n)
+                        continue
 
-                file_offset = lcn * file_record.mft.sectors_per_cluster * file_record.mft.bytes_per_sector
-                size_in_bytes = n * file_record.mft.sectors_per_cluster * file_record.mft.bytes_per_sector
+                    file_offset = lcn * file_record.mft.sectors_per_cluster * file_record.mft.bytes_per_sector
+                    size_in_bytes = n * file_record.mft.sectors_per_cluster * file_record.mft.bytes_per_sector
 
-                log.debug('DATA: 0x{:04x} clusters @ LCN 0x{:04x}, @ f_offset 0x{:x}, size_in_bytes {}'.format(n, lcn, file_offset, size_in_bytes))
+                    log.debug('DATA: 0x%04x clusters @ LCN 0x%04x, @ f_offset 0x%x, size_in_bytes %s', n, lcn, file_offset, size_in_bytes)
 
             start_vcn = self.attribute.std_header.start_vcn
             last_vcn = self.attribute.std_header.last_vcn
@@ -559,22 +870,22 @@ class Attribute_ATTRIBUTE_LIST(Attribute_TYPES):
 
         while attribute_list_length > 0:
             self.type = data.getDWORD(ao + 0x00)
-            log.debug('\t\tType: {} (0x{:0X})'.format(self.file_record.mft.AttrDef.getByType(self.type).name, self.type))
+            log.debug('\t\tType: %s (0x%0X)', self.file_record.mft.AttrDef.getByType(self.type).name, self.type)
 
             if self.type == 0x0:
                 break
 
             self.record_length = data.getWORD(ao + 0x04)
-            log.debug('\t\tRecord length: 0x{:0X}'.format(self.record_length))
+            log.debug('\t\tRecord length: 0x%0X', self.record_length)
 
             self.name_length = data.getBYTE(ao + 0x06)
-            log.debug('\t\tName length: 0x{:0X}'.format(self.name_length))
+            log.debug('\t\tName length: 0x%0X', self.name_length)
 
             self.offset_to_name = data.getBYTE(ao + 0x07)
-            log.debug('\t\tOffset to name: 0x{:0X}'.format(self.offset_to_name))
+            log.debug('\t\tOffset to name: 0x%0X', self.offset_to_name)
 
             self.starting_vcn = data.getQWORD(ao + 0x08)
-            log.debug('\t\tStarting VCN: 0x{:0X}'.format(self.starting_vcn))
+            log.debug('\t\tStarting VCN: 0x%0X', self.starting_vcn)
 
             self.attribute_id = data.getWORD(ao + 0x18)
             #log.debug('\t\tAttribute Id: 0x{:0X}'.format(self.attribute_id))            
@@ -582,13 +893,13 @@ class Attribute_ATTRIBUTE_LIST(Attribute_TYPES):
             self.base_file_reference = data.getQWORD(ao + 0x10)
 
             file_reference = filerecord.FileReference(self.base_file_reference)
-            log.debug('\t\tBase file reference: 0x{:0X}'.format(file_reference.record_number))
+            log.debug('\t\tBase file reference: 0x%0X', file_reference.record_number)
 
             if self.name_length != 0:
                 self.name = data.getStream(ao + self.offset_to_name, ao + self.offset_to_name + self.name_length*2)
 
                 name = helper.Helper._widechar_to_ascii(self.name)
-                log.debug('\t\tName: {}'.format(name))
+                log.debug('\t\tName: %s', name)
 
             log.debug('')
 
@@ -596,14 +907,18 @@ class Attribute_ATTRIBUTE_LIST(Attribute_TYPES):
             attribute_list_length -= self.record_length
 
             if file_reference.record_number != self.file_record.inode:
-                unq_file_records[file_reference.record_number] = ''
+                unq_file_records[file_reference.record_number] = file_reference.seq_number
 
-        for inode in unq_file_records:
+        for inode, seq_number in unq_file_records.items():
 
             log.debug('+++++ <file record from attribute list> +++++')
-            fr = self.file_record.mft.get_file_record(inode)
+            fr = self.file_record.mft.get_file_record(inode, seq_number)
             log.debug('+++++ </file record from attribute list> +++++')
 
+            if fr is None:
+                log.debug('extension file record #%s not found (stale reference)', inode)
+                continue
+
             # add attributes
             for attr in fr.attributes:
                 self.file_record.add_attribute(attr)
@@ -623,24 +938,33 @@ class Attribute_FILE_NAME(Attribute_TYPES):
         data = attribute.data
         ao   = attribute.ao
 
+        self.parent_reference = filerecord.FileReference(data.getQWORD(ao + attribute.std_header.offset_to_attribute + 0x00))
+        log.debug('Parent directory: #%s', self.parent_reference.record_number)
+
+        # FILETIMEs
+        self.creation_time         = data.getQWORD(ao + attribute.std_header.offset_to_attribute + 0x08)
+        self.modification_time     = data.getQWORD(ao + attribute.std_header.offset_to_attribute + 0x10)
+        self.mft_modification_time = data.getQWORD(ao + attribute.std_header.offset_to_attribute + 0x18)
+        self.access_time           = data.getQWORD(ao + attribute.std_header.offset_to_attribute + 0x20)
+
         self.allocated_size_of_file = data.getQWORD(ao + attribute.std_header.offset_to_attribute + 0x28)
-        log.debug('Allocated size of file: 0x{:0X}'.format(self.allocated_size_of_file))
+        log.debug('Allocated size of file: 0x%0X', self.allocated_size_of_file)
 
         self.real_size_of_file = data.getQWORD(ao + attribute.std_header.offset_to_attribute + 0x30)
-        log.debug('Real size of file: 0x{:0X}'.format(self.real_size_of_file))
+        log.debug('Real size of file: 0x%0X', self.real_size_of_file)
 
         self.attr_flags = data.getDWORD(ao + attribute.std_header.offset_to_attribute + 0x38)
-        log.debug('Flags: 0x{:0X}'.format(self.attr_flags))
+        log.debug('Flags: 0x%0X', self.attr_flags)
 
         self.filename_length = data.getBYTE(ao + attribute.std_header.offset_to_attribute + 0x40)
 
         self.filename_namespace = data.getBYTE(ao + attribute.std_header.offset_to_attribute + 0x41)
-        log.debug('Filename namespace: {}'.format(self.filename_namespace))
+        log.debug('Filename namespace: %s', self.filename_namespace)
 
         filename_offset = ao + attribute.std_header.offset_to_attribute + 0x42
         attr_filename = data.getStream(filename_offset, filename_offset + self.filename_length * 2)
 
         self.attr_filename = helper.Helper._widechar_to_ascii(attr_filename)
-        log.debug('File name: {0}'.format(self.attr_filename))
+        log.debug('File name: %s', self.attr_filename)
 
         log.debug('')
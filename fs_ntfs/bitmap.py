@@ -0,0 +1,109 @@
+import re
+
+# bytes that hold at least one bit set / one bit clear, the search skips whole 0x00 / 0xFF bytes
+_ANY_SET   = re.compile(b'[^\x00]')
+_ANY_CLEAR = re.compile(b'[^\xff]')
+
+# count() converts at most this many bytes to one int at a time, big volumes have $Bitmap of hundreds of MB
+COUNT_CHUNK_SIZE = 1024 * 1024
+
+class Bitset(object):
+    # bits over a bytes buffer, as NTFS stores them ($MFT:$BITMAP, $Bitmap, index $BITMAP):
+    # bit k is bit (k % 8) of byte (k // 8). size is in bits, the rest of the buffer is ignored.
+    def __init__(self, data, size=None):
+        self._data = bytes(data)
+
+        if size is None or size > len(self._data) * 8:
+            size = len(self._data) * 8
+
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, k):
+        if not 0 <= k < self.size:
+            return False
+
+        return bool(self._data[k >> 3] & (1 << (k & 7)))
+
+    def count(self, start=0, end=None):
+        # popcount of bits [start, end)
+        if start < 0:
+            start = 0
+
+        if end is None or end > self.size:
+            end = self.size
+
+        if start >= end:
+            return 0
+
+        n = 0
+
+        # bits of a partial first byte
+        if start & 7:
+            stop = min(end, (start | 7) + 1)
+            n += ((self._data[start >> 3] >> (start & 7)) & ((1 << (stop - start)) - 1)).bit_count()
+            start = stop
+
+        # whole bytes, in chunks
+        first = start >> 3
+        last = end >> 3
+
+        view = memoryview(self._data)
+        for k in range(first, last, COUNT_CHUNK_SIZE):
+            n += int.from_bytes(view[k:min(k + COUNT_CHUNK_SIZE, last)], 'little').bit_count()
+
+        # bits of a partial last byte
+        if end & 7 and start < end:
+            n += (self._data[last] & ((1 << (end & 7)) - 1)).bit_count()
+
+        return n
+
+    def find(self, value=True, start=0):
+        # first bit equal to value at or after start, None if there is none
+        if start < 0:
+            start = 0
+
+        if start >= self.size:
+            return None
+
+        k = start >> 3
+
+        b = self._data[k] if value else self._data[k] ^ 0xFF
+        b >>= start & 7
+
+        if b:
+            found = start + ((b & -b).bit_length() - 1)
+        else:
+            m = (_ANY_SET if value else _ANY_CLEAR).search(self._data, k + 1)
+            if m is None:
+                return None
+
+            k = m.start()
+            b = self._data[k] if value else self._data[k] ^ 0xFF
+
+            found = k * 8 + ((b & -b).bit_length() - 1)
+
+        if found >= self.size:
+            return None
+
+        return found
+
+    def extents(self, value=True, start=0, end=None):
+        # coalesced runs of bits equal to value inside [start, end), as (first bit, number of bits)
+        if end is None or end > self.size:
+            end = self.size
+
+        k = start
+        while k < end:
+            a = self.find(value, k)
+            if a is None or a >= end:
+                return
+
+            b = self.find(not value, a)
+            if b is None or b > end:
+                b = end
+
+            yield a, b - a
+            k = b
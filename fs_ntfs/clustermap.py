@@ -0,0 +1,122 @@
+import bisect
+import collections
+
+from . import helper
+
+# owner of one cluster: base file record, attribute ($DATA, $INDEX_ALLOCATION, ...), stream name, VCN
+ClusterOwner = collections.namedtuple('ClusterOwner', 'inode attribute stream vcn')
+
+def _cluster_runs(file_record):
+    # runs in the scan workers: (lcn, n_clusters, base record, attribute, stream, vcn) of every
+    # allocated run of every non-resident attribute ($MFT itself is record #0)
+    base = file_record.file_reference.record_number
+    inode = base if base != 0 else file_record.inode
+
+    runs = []
+    for attribute in file_record.get_non_resident_attributes():
+        header = attribute.std_header
+        vcn = header.start_vcn
+
+        for n, lcn in attribute.data_runs:
+            if lcn is not None:
+                runs.append((lcn, n, inode, header.attrdef.name, header.name, vcn))
+
+            vcn += n
+
+    return runs
+
+class ClusterMap(object):
+    # LCN -> owner, an interval index over the runlists of the whole volume.
+    # runs are sorted by LCN once, a lookup is a bisect over the run starts.
+    # cross-linked (overlapping) runs resolve to the one starting last, the greatest
+    # end seen so far tells how far back a lookup has to step over them.
+    def __init__(self, bytes_per_cluster):
+        self.bytes_per_cluster = bytes_per_cluster
+
+        self._runs = []
+
+        self._starts = None
+        self._ends = None
+        self._reach = None
+
+    @classmethod
+    def from_mft(cls, mft, jobs=1, allocated=True):
+        # one scan of the $MFT, only records in use by default (free records may hold stale runs)
+        bytes_per_cluster = mft.sectors_per_cluster * mft.bytes_per_sector
+        cmap = cls(bytes_per_cluster)
+
+        for runs in mft.map_file_records(_cluster_runs, jobs=jobs, lazy=True, allocated=allocated):
+            for run in runs:
+                cmap.add(*run)
+
+        helper.Helper.logger().debug('cluster map: %s runs', len(cmap._runs))
+
+        return cmap
+
+    def add(self, lcn, n_clusters, inode, attribute, stream, vcn):
+        if n_clusters <= 0:
+            return
+
+        self._runs.append((lcn, n_clusters, inode, attribute, stream, vcn))
+        self._starts = None
+
+    def __len__(self):
+        return len(self._runs)
+
+    def _build(self):
+        if self._starts is None:
+            self._runs.sort(key=lambda run: run[0])
+
+            self._starts = [run[0] for run in self._runs]
+            self._ends = [run[0] + run[1] for run in self._runs]
+
+            self._reach = []
+            reach = 0
+            for end in self._ends:
+                reach = max(reach, end)
+                self._reach.append(reach)
+
+    def _owner(self, k, lcn):
+        # k is the last run starting at or before lcn
+        while k >= 0 and lcn >= self._ends[k]:
+            if lcn >= self._reach[k]:
+                # no run up to k gets to lcn
+                return None
+
+            k -= 1
+
+        if k < 0:
+            return None
+
+        start, _, inode, attribute, stream, vcn = self._runs[k]
+        return ClusterOwner(inode, attribute, stream, vcn + lcn - start)
+
+    def owner_of_cluster(self, lcn):
+        # ClusterOwner of cluster lcn, None for clusters no runlist points to
+        self._build()
+        return self._owner(bisect.bisect_right(self._starts, lcn) - 1, lcn)
+
+    def owner_of_offset(self, offset):
+        # ClusterOwner of a byte offset in the volume
+        return self.owner_of_cluster(offset // self.bytes_per_cluster)
+
+    def owners_of_offsets(self, offsets):
+        # (offset, ClusterOwner or None) for many offsets, in offset order. queries are sorted
+        # and each bisect starts where the previous one ended
+        self._build()
+
+        k = 0
+        for offset in sorted(offsets):
+            lcn = offset // self.bytes_per_cluster
+
+            k = bisect.bisect_right(self._starts, lcn, k) - 1
+            yield offset, self._owner(k, lcn)
+
+            k = max(k, 0)
+
+    def extents(self):
+        # (lcn, n_clusters, ClusterOwner of the first cluster), in LCN order
+        self._build()
+
+        for lcn, n, inode, attribute, stream, vcn in self._runs:
+            yield lcn, n, ClusterOwner(inode, attribute, stream, vcn)
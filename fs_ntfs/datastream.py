@@ -0,0 +1,130 @@
+import io
+
+from . import helper
+from . import runlist
+
+class StreamReader(io.RawIOBase):
+    # seekable, read only view of one stream ($DATA attributes of the same name), see
+    # FileRecord.open(). reads go straight to the clusters holding them, holes and VCNs
+    # no attribute maps read as zeros, nothing is read past the real size.
+    def __init__(self, file_record, datas):
+        super().__init__()
+
+        log = helper.Helper.logger()
+
+        mft = file_record.mft
+
+        self.file_record = file_record
+        self.bytes_per_cluster = mft.sectors_per_cluster * mft.bytes_per_sector
+
+        datas = sorted(datas, key=lambda x: getattr(x.attribute.std_header, 'start_vcn', 0))
+
+        first = datas[0].attribute
+
+        # only the first attribute of a stream split by $ATTRIBUTE_LIST has the real size
+        self.size = first.std_header.attr_real_size
+
+        self._blob = None
+        self._runs = None
+        self._dataModel = first.dataModel
+
+        if not first.std_header.non_resident_flag:
+            self._blob = bytes(datas[0].blob)
+        else:
+            runs = []
+            vcn = 0
+
+            for data in datas:
+                header = data.attribute.std_header
+                if not header.non_resident_flag:
+                    log.debug('resident $DATA among non-resident ones, skipped.')
+                    continue
+
+                if header.start_vcn > vcn:
+                    # not mapped by any attribute, read as a hole
+                    runs.append((header.start_vcn - vcn, None))
+                    vcn = header.start_vcn
+
+                for n, lcn in data.attribute.data_runs:
+                    runs.append((n, lcn))
+                    vcn += n
+
+            self._runs = runlist.RunList(runs)
+
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError('invalid whence ({})'.format(whence))
+
+        if pos < 0:
+            raise ValueError('negative seek position {}'.format(pos))
+
+        self._pos = pos
+        return pos
+
+    def readinto(self, b):
+        if self.closed:
+            raise ValueError('I/O operation on closed file.')
+
+        out = memoryview(b).cast('B')
+
+        size = min(len(out), self.size - self._pos)
+        if size <= 0:
+            return 0
+
+        if self._blob is not None:
+            out[:size] = self._blob[self._pos:self._pos + size]
+        else:
+            self._read_runs(out[:size], self._pos)
+
+        self._pos += size
+        return size
+
+    def _read_runs(self, out, pos):
+        bytes_per_cluster = self.bytes_per_cluster
+
+        done = 0
+        while done < len(out):
+            vcn, rel = divmod(pos + done, bytes_per_cluster)
+
+            found = self._runs.find_vcn(vcn)
+            if found is None:
+                # past the last run
+                out[done:] = bytes(len(out) - done)
+                return
+
+            (n, lcn), rel_vcn = found
+
+            # bytes left in this run
+            count = min(len(out) - done, (n - rel_vcn) * bytes_per_cluster - rel)
+
+            if lcn is None:
+                out[done:done + count] = bytes(count)
+            else:
+                offset = (lcn + rel_vcn) * bytes_per_cluster + rel
+                data = self._dataModel.getStream(offset, offset + count)
+
+                got = len(data)
+                out[done:done + got] = data
+
+                if got < count:
+                    # image is shorter than the volume
+                    out[done + got:done + count] = bytes(count - got)
+
+            done += count
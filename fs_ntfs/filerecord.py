@@ -1,38 +1,114 @@
 from . import helper
+from . import attributes
+from . import datastream
+from . import indexes
 from . import ntfs
 
+# fetch_file() reads streams through one buffer of this size
+FETCH_CHUNK_SIZE = 4 * 1024 * 1024
+
 class FileReference(object):
     def __init__(self, file_reference):
         self.record_number =  file_reference & 0x0000FFFFFFFFFFFF
         self.seq_number    = (file_reference & 0xFFFF000000000000) >> 48
 
 class FileRecord(object):
-    def __init__(self, mft):
-        self.attributes = []
-        self.attributes_dict = {}
+    def __init__(self, mft, lazy=False):
+        self._attributes = []
+        self._attributes_dict = {}
+
+        # attributes with only the header parsed, type objects are not built yet
+        self._pending = []
+
         self.mft = mft
+        self.lazy = lazy
+
+    @property
+    def attributes(self):
+        self.materialize()
+        return self._attributes
+
+    @property
+    def attributes_dict(self):
+        self.materialize()
+        return self._attributes_dict
 
     def add_attribute(self, attribute):
+        # attribute.obj is already built
+        self._attributes += [attribute]
+        self._index_attribute(attribute)
+
+    def add_pending_attribute(self, attribute):
+        self._attributes += [attribute]
+        self._pending += [attribute]
+
+    def _index_attribute(self, attribute):
 
         name = attribute.std_header.attrdef.name
-        if name not in self.attributes_dict:
-            self.attributes_dict[name] = [attribute.obj]
+        if name not in self._attributes_dict:
+            self._attributes_dict[name] = [attribute.obj]
         else:
-            self.attributes_dict[name] += [attribute.obj]
+            self._attributes_dict[name] += [attribute.obj]
+
+    def materialize(self, name=None):
+        # build type objects for pending attributes, all of them or only the ones called name,
+        # then postprocess them. lazy records get here on first access.
+        if not self._pending:
+            return
+
+        if name is not None and name != '$ATTRIBUTE_LIST':
+            # extension records may hold more attributes called name
+            self.materialize('$ATTRIBUTE_LIST')
+
+        todo = [attribute for attribute in self._pending if name is None or attribute.std_header.attrdef.name == name]
+        if not todo:
+            return
+
+        self._pending = [attribute for attribute in self._pending if attribute not in todo]
+
+        log = helper.Helper.logger()
 
-        self.attributes += [attribute]
+        for attribute in todo:
+            attribute.obj = attributes.AttributeTypeFactory.recognize(attribute, self)
+            if attribute.obj is None:
+                log.debug('Attribute %s (0x%x) not supported yet.', attribute.std_header.attrdef.name, attribute.std_header.attrdef.type)
+                log.debug('')
+
+            self._index_attribute(attribute)
+
+        # postprocessing
+        log.debug('postprocessing....')
+        for attribute in todo:
+            if attribute.obj:
+                attribute.obj.postprocess()
+
+    def get_non_resident_attributes(self):
+        # attributes with a runlist, type objects are not built
+        return [attribute for attribute in self._attributes if attribute.std_header.non_resident_flag]
 
     def get_attribute(self, name):
-        if name not in self.attributes_dict:
+        self.materialize(name)
+
+        if name not in self._attributes_dict:
             return None
 
-        return self.attributes_dict[name]
+        return self._attributes_dict[name]
 
     def get_displayed_filename(self):
-        filenames = self.get_file_names()
+        filename = self.get_displayed_filename_attribute()
+        if filename is None:
+            return None
+
+        return filename.attr_filename
+
+    def get_displayed_filename_attribute(self):
+        # $FILE_NAME that is displayed, it also gives the parent directory
+        filenames = self.get_attribute('$FILE_NAME')
+        if filenames is None:
+            return None
 
         for namespace in [ntfs.FileNamespace.POSIX, ntfs.FileNamespace.WIN32, ntfs.FileNamespace.WIN32_AND_DOS, ntfs.FileNamespace.DOS]:
-            L = [u for u, v in filenames if v == namespace]
+            L = [attr for attr in filenames if attr.filename_namespace == namespace]
             if len(L) > 0:
                 return L[0]
 
@@ -46,15 +122,20 @@ class FileRecord(object):
         filenames_attr = [(attr.attr_filename, attr.filename_namespace) for attr in filenames_attr]
         return filenames_attr
 
-    def fetch_file(self, fo, stream=None):
+    def fetch_file(self, fo, stream=None, chunk_size=FETCH_CHUNK_SIZE, buffer=None):
+        # stream written to fo through one reused buffer (bytearray), memory use is bounded
+        # by its size. callers extracting many files can pass their own buffer
         log = helper.Helper.logger()
 
         log.debug('fetch file...')
 
+        if buffer is None:
+            buffer = bytearray(chunk_size)
+
         written_size = 0
-        for chunk in self.get_file_data(stream):
+        for chunk in self.get_file_data(stream, buffer=buffer):
             chunk_size = len(chunk)
-            log.debug('\twrite {:,} bytes to file.'.format(chunk_size))
+            log.debug('\twrite %d bytes to file.', chunk_size)
             fo.write(chunk)
 
             written_size += chunk_size
@@ -62,6 +143,15 @@ class FileRecord(object):
 
         return written_size
 
+    def open(self, stream=None):
+        # datastream.StreamReader over a stream (the unnamed one by default), for random access.
+        # wrap it in io.BufferedReader for small reads
+        datas = self.get_file_streams().get(stream or '')
+        if not datas:
+            raise ntfs.NtfsError('Stream {} not found in file record #{}.'.format(stream or '$DATA', self.inode))
+
+        return datastream.StreamReader(self, datas)
+
     def get_file_streams(self):
         log = helper.Helper.logger()
 
@@ -79,7 +169,7 @@ class FileRecord(object):
             name = data.attribute.std_header.name
 
             if name:
-                log.debug('stream name: {}'.format(name))
+                log.debug('stream name: %s', name)
                 if name in streams:
                     streams[name] += [data]
                 else:
@@ -98,6 +188,56 @@ class FileRecord(object):
         name = index.attribute.std_header.name
         return name == '$I30'
 
+    def find_entries(self, names, ignore_case=False):
+        # batched lookup of names in this directory, {name: index entry} of the names found.
+        # the $I30 b-tree is walked once for all of them
+        found = {}
+
+        indexs = self.get_attribute('$INDEX_ROOT')
+        if indexs is None:
+            return found
+
+        upcase = self.mft.get_upcase_table()
+
+        for index in indexs:
+            if not self._is_directory_index(index):
+                continue
+
+            missing = [name for name in names if name not in found]
+            found.update(index.find_many(missing, upcase, ignore_case))
+
+        return found
+
+    def stat(self):
+        # indexes.FileStat of this record, from its $FILE_NAME
+        filename = self.get_displayed_filename_attribute()
+        if filename is None:
+            return None
+
+        return indexes.file_stat(FileReference(self.seq_number << 48 | self.inode), filename.attr_filename, filename)
+
+    def scandir(self):
+        # index entries of this directory in collation order, DOS names skipped.
+        # streamed from the $I30 b-tree, stop iterating to stop reading
+        indexs = self.get_attribute('$INDEX_ROOT')
+        if indexs is None:
+            return
+
+        for index in indexs:
+            if not self._is_directory_index(index):
+                continue
+
+            for entry in index.iter_entries():
+                if entry.filename_namespace == ntfs.FileNamespace.DOS:
+                    continue
+
+                yield entry
+
+    def iterdir(self):
+        # names in this directory, see scandir()
+        for entry in self.scandir():
+            yield entry.filename
+
     def list_dir(self, levels=1):
         if levels == 0:
             return None
@@ -129,10 +269,11 @@ class FileRecord(object):
                     already.add(a.file_reference.record_number)
                     name = a.filename
 
-                    if a.file_reference.record_number != 5:
-                        fr = self.mft.get_file_record(a.file_reference.record_number)
+                    # the index entry tells directories apart, files are not read
+                    if a.file_reference.record_number != 5 and levels != 1 and a.is_dir():
+                        fr = self.mft.get_file_record(a.file_reference.record_number, a.file_reference.seq_number, lazy=True)
 
-                        Res = fr.list_dir(levels-1)
+                        Res = fr.list_dir(levels-1) if fr is not None else None
                         D.append((name, Res))
                     else:
                         D.append((name, None))
@@ -148,18 +289,18 @@ class FileRecord(object):
         root = self
 
         if self._has_reparse_point():
-            log.debug('reparse point: {}'.format(root.get_displayed_filename()))
+            log.debug('reparse point: %s', root.get_displayed_filename())
 
             reparse = root.get_attribute('$REPARSE_POINT')
 
             symlink = reparse[0].substitute_path
-            log.debug('symlink: {}'.format(symlink))
+            log.debug('symlink: %s', symlink)
 
             # get rid of windows stuff
             symlink = symlink[7:]
 
             resolved = symlink
-            log.debug('resolved path: {}'.format(resolved))
+            log.debug('resolved path: %s', resolved)
 
             return resolved
 
@@ -183,7 +324,7 @@ class FileRecord(object):
             if stream in streams:
                 stream_datas = streams[stream]
             else:
-                log.debug('Stream {} not found.'.format(stream))
+                log.debug('Stream %s not found.', stream)
                 return None
 
         first_data = stream_datas[0]
@@ -193,7 +334,9 @@ class FileRecord(object):
 
 
 
-    def get_file_data(self, stream=None):
+    def get_file_data(self, stream=None, buffer=None):
+        # chunks of a stream. with a buffer, chunks are read into it (see
+        # Attribute_TYPES.get_data_into()) and must be consumed before asking for the next one
         log = helper.Helper.logger()
 
         datas = self.get_attribute('$DATA')
@@ -206,7 +349,7 @@ class FileRecord(object):
             if stream in streams:
                 stream_datas = streams[stream]
             else:
-                log.debug('Stream {} not found.'.format(stream))
+                log.debug('Stream %s not found.', stream)
                 raise StopIteration()
        
         # sort it. do we need to ?
@@ -231,15 +374,16 @@ class FileRecord(object):
             pass
 
         file_size = first_data.attribute.std_header.attr_real_size
-        log.debug('file size: {:,}'.format(file_size))
+        log.debug('file size: %d', file_size)
 
         file_chunks = ''
         for data in stream_datas:
             # fetch
-            for chunk in data.get_data():
-            #chunk = data.get_data()
+            chunks = data.get_data() if buffer is None else data.get_data_into(buffer)
+
+            for chunk in chunks:
 
-                log.debug('get {:,} bytes from attribute.'.format(len(chunk)))
+                log.debug('get %d bytes from attribute.', len(chunk))
                 chunk_size = len(chunk)
 
                 if chunk_size > file_size:
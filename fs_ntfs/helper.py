@@ -1,13 +1,122 @@
+import collections
 import logging
+import threading
+
+# detailed debug log by default. the level is set once, setLevel() on every
+# logger() call would flush the logging level cache each time.
+logging.getLogger('fs_ntfs').setLevel(logging.DEBUG)
+
+# 1970-01-01 as a FILETIME
+FILETIME_UNIX_EPOCH = 116444736000000000
 
 class Helper(object):
     @staticmethod
     def _widechar_to_ascii(s):
         return s.decode("utf-16", 'ignore').strip('\x00')
 
+    @staticmethod
+    def filetime_to_unix(filetime):
+        # 100ns intervals since 1601-01-01 -> seconds since 1970-01-01
+        return (filetime - FILETIME_UNIX_EPOCH) / 10000000
+
     @staticmethod
     def logger():
-        logger = logging.getLogger('fs_ntfs')
-        logger.setLevel(logging.DEBUG)
-        return logger
+        return logging.getLogger('fs_ntfs')
+
+    @staticmethod
+    def set_debug(enabled):
+        # with debug off, the parsing hot paths do not format anything:
+        # log calls are lazy (%-style) and dumps are guarded by isEnabledFor().
+        logging.getLogger('fs_ntfs').setLevel(logging.DEBUG if enabled else logging.WARNING)
+
+class LRUCache(object):
+    # least recently used cache, bounded by number of items and/or by a byte budget.
+    # every entry carries its own (estimated) size, default is 1. safe to share between threads.
+    def __init__(self, max_items=None, max_bytes=None):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+
+        self._items = collections.OrderedDict()
+        self._bytes = 0
+
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, size = self._items[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, size=1):
+        with self._lock:
+            if key in self._items:
+                self._bytes -= self._items.pop(key)[1]
+
+            self._items[key] = (value, size)
+            self._bytes += size
+
+            self._evict()
+
+    def resize(self, key, value, size):
+        # new size of an entry that grew in place, only if key still holds value.
+        # not a lookup, hits and recency are left alone
+        with self._lock:
+            if key not in self._items or self._items[key][0] is not value:
+                return
+
+            self._bytes += size - self._items[key][1]
+            self._items[key] = (value, size)
+
+            self._evict()
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._items.clear()
+                self._bytes = 0
+                return
+
+            if key in self._items:
+                self._bytes -= self._items.pop(key)[1]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else 0.0,
+                    'evictions': self.evictions,
+                    'items': len(self._items),
+                    'bytes': self._bytes}
+
+    def _over_budget(self):
+        if self.max_items is not None and len(self._items) > self.max_items:
+            return True
+
+        if self.max_bytes is not None and self._bytes > self.max_bytes:
+            return True
+
+        return False
 
+    def _evict(self):
+        while self._items and self._over_budget():
+            key, (value, size) = self._items.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
@@ -1,6 +1,67 @@
+import collections
+import struct
+
 from . import helper
 from . import filerecord
 
+# index entry header: file reference, length of entry, length of stream, flags
+INDEX_ENTRY_HEADER = struct.Struct('<QHHB')
+
+# $I30 key, a copy of the $FILE_NAME value: parent reference, creation, modification,
+# mft modification and access times, allocated size, real size, flags, reparse tag
+FILE_NAME_KEY = struct.Struct('<QQQQQQQII')
+
+# $FILE_NAME flags, set for directories (the record has an $I30 index)
+FILE_NAME_DIRECTORY = 0x10000000
+
+# what a directory listing knows about a child without reading its file record.
+# times are FILETIMEs, see helper.Helper.filetime_to_unix()
+FileStat = collections.namedtuple('FileStat', 'inode seq_number name parent is_dir size allocated_size attr_flags '
+                                              'creation_time modification_time mft_modification_time access_time')
+
+def file_stat(file_reference, name, filename):
+    # FileStat from an $I30 index entry or an Attribute_FILE_NAME, they hold the same fields.
+    # windows updates sizes and times in the parent index lazily, the file record has the last word
+    return FileStat(file_reference.record_number, file_reference.seq_number, name,
+                    filename.parent_reference.record_number, bool(filename.attr_flags & FILE_NAME_DIRECTORY),
+                    filename.real_size_of_file, filename.allocated_size_of_file, filename.attr_flags,
+                    filename.creation_time, filename.modification_time, filename.mft_modification_time, filename.access_time)
+
+# $I30 keys are ordered by their upcased UTF-16 code units. this table comes from the
+# unicode database, it stands in for the volume $UpCase. see filename_key().
+_default_upcase = None
+
+def default_upcase_table():
+    global _default_upcase
+
+    if _default_upcase is None:
+        table = []
+        for c in range(0x10000):
+            u = chr(c).upper()
+
+            # one code unit maps to one code unit
+            table.append(u if len(u) == 1 else chr(c))
+
+        _default_upcase = ''.join(table)
+
+    return _default_upcase
+
+def filename_key(name, upcase=None):
+    # collation key of a file name, upcase is a 65536 chars translation table.
+    # NTFS compares upcased UTF-16 code units, not code points: a surrogate pair
+    # (0xD800-0xDFFF) sorts before 0xE000-0xFFFF, so the key is the big endian UTF-16 bytes
+    if upcase is None:
+        upcase = default_upcase_table()
+
+    return name.translate(upcase).encode('utf-16-be', 'surrogatepass')
+
+def collate_filename(a, b, upcase=None):
+    # NTFS filename collation: <0, 0, >0
+    a = filename_key(a, upcase)
+    b = filename_key(b, upcase)
+
+    return (a > b) - (a < b)
+
 class IndexHeader(object):
     def __init__(self):
         pass
@@ -9,6 +70,14 @@ class IndexEntry(object):
     def __init__(self):
         pass
 
+    def is_dir(self):
+        # $I30 entries only
+        return bool(self.attr_flags & FILE_NAME_DIRECTORY)
+
+    def stat(self):
+        # $I30 entries only, nothing is read
+        return file_stat(self.file_reference, self.filename, self)
+
 class IndexTypeFactory(object):
     @staticmethod
     def recognize(index_name):
@@ -49,35 +118,35 @@ class Index_R(Index_TYPES):
 
             # index entry
             offset_data = data.getWORD(off + 0)
-            log.debug('offset to data: 0x{:x}'.format(offset_data))
+            log.debug('offset to data: 0x%x', offset_data)
 
             size_data = data.getWORD(off + 0x2)
-            log.debug('size of data: 0x{:x}'.format(size_data))
+            log.debug('size of data: 0x%x', size_data)
 
             size_entry = data.getWORD(off + 0x8)
-            log.debug('size of entry: 0x{:x}'.format(size_entry))
+            log.debug('size of entry: 0x%x', size_entry)
 
             size_key = data.getWORD(off + 0xA)
-            log.debug('size of key: 0x{:x}'.format(size_key))
+            log.debug('size of key: 0x%x', size_key)
 
             r_flags = data.getWORD(off + 0x0C)
-            log.debug('flags: 0x{:x}'.format(r_flags))
+            log.debug('flags: 0x%x', r_flags)
 
             tag = data.getDWORD(off + 0x10)
-            log.debug('key reparse tag: 0x{:x}'.format(tag))
+            log.debug('key reparse tag: 0x%x', tag)
 
             key_mft = data.getQWORD(off + 0x14)
 
             entry.mft_file_record = filerecord.FileReference(key_mft)
             key_mft_fr = entry.mft_file_record.record_number
 
-            log.debug('key mft reference of reparse point: 0x{:x}, 0x{:x}'.format(key_mft, key_mft_fr))
+            log.debug('key mft reference of reparse point: 0x%x, 0x%x', key_mft, key_mft_fr)
             
             #self.file_record.mft.get_file_record(key_mft_fr)
 
             if r_flags & 1:
                 vcn = data.getDWORD(off + 0x20)
-                log.debug('vcn 0x{:x}'.format(vcn))
+                log.debug('vcn 0x%x', vcn)
 
                 entry.subnode_vcn = vcn
                 nodes += [entry]
@@ -106,65 +175,81 @@ class Index_I30(Index_TYPES):
         return
 
     def iterate_index_entries(self, data, off):
-        log = helper.Helper.logger()
-
         nodes = []
         entries = []
+        for entry in self.iter_node_entries(data, off):
+            if entry.index_flags & 1:
+                nodes += [entry]
+
+            if entry.index_flags & 2:
+                # last index entry, exiting
+                break
+
+            entries.append(entry)
+
+        return nodes, entries
+
+    def iter_node_entries(self, data, off):
+        # entries of one b-tree node, in collation order. the last one (flags & 2) has no key,
+        # it only points to the sub-node with the greatest keys, if any.
         while 1:
-            log.debug('')
-            log.debug('-= index entry =-')
+            entry = self._parse_entry(data, off)
+            yield entry
 
-            entry = IndexEntry()
+            if entry.index_flags & 2 or entry.length_index_entry == 0:
+                return
 
-            # index entry
-            file_reference = data.getQWORD(off + 0)
-            #print 'File reference: 0x{:0X}'.format(file_reference)
+            off += entry.length_index_entry
 
-            entry.file_reference = filerecord.FileReference(file_reference)
-            log.debug('file record: #{}'.format(entry.file_reference.record_number))
+    def _parse_entry(self, data, off):
+        log = helper.Helper.logger()
 
-            entry.length_index_entry = data.getWORD(off + 8)
-            #print 'Length of the index entry: 0x{:0X}'.format(entry.length_index_entry)
+        log.debug('')
+        log.debug('-= index entry =-')
 
-            entry.length_stream = data.getWORD(off + 10)
-            #print 'Length of the stream: 0x{:0X}'.format(entry.length_stream)
+        entry = IndexEntry()
 
-            entry.index_flags = data.getBYTE(off + 12)
-            log.debug('Index flags: 0x{:0X}'.format(entry.index_flags))
+        # index entry
+        file_reference, entry.length_index_entry, entry.length_stream, entry.index_flags = data.unpack(INDEX_ENTRY_HEADER, off)
 
-            if entry.index_flags & 1:
-                entry.subnode_vcn = data.getQWORD(off + entry.length_index_entry - 8)
-                log.debug('Last index entry, VCN of the sub-node in the Index Allocation: 0x{:0X}'.format(entry.subnode_vcn))
-                nodes += [entry]
+        entry.file_reference = filerecord.FileReference(file_reference)
+        log.debug('file record: #%s', entry.file_reference.record_number)
 
-            if entry.index_flags & 2:
-                # last index entry, exiting
-                break
+        log.debug('Index flags: 0x%0X', entry.index_flags)
 
+        if entry.index_flags & 1:
+            entry.subnode_vcn = data.getQWORD(off + entry.length_index_entry - 8)
+            log.debug('Last index entry, VCN of the sub-node in the Index Allocation: 0x%0X', entry.subnode_vcn)
 
-            entry.real_size_of_file = data.getQWORD(off + 0x40)
-            log.debug('Real size of file: {:,}'.format(entry.real_size_of_file))
+        if entry.index_flags & 2:
+            # last index entry, no file name
+            return entry
 
-            entry.filename_namespace = data.getBYTE(off + 0x51)
-            log.debug('Filename namespace: {}'.format(entry.filename_namespace))
+        # $FILE_NAME copy
+        (parent_reference, entry.creation_time, entry.modification_time, entry.mft_modification_time, entry.access_time,
+         entry.allocated_size_of_file, entry.real_size_of_file, entry.attr_flags, entry.reparse_tag) = data.unpack(FILE_NAME_KEY, off + 0x10)
 
-            entry.length_of_filename = data.getBYTE(off + 0x50)
-            log.debug('Length of the filename: 0x{:0X}'.format(entry.length_of_filename))
+        entry.parent_reference = filerecord.FileReference(parent_reference)
 
-            entry.offset_to_filename = data.getWORD(off + 0x0a)
-            log.debug('Offset to filename: 0x{:0X}'.format(entry.offset_to_filename))
+        log.debug('Parent directory: #%s', entry.parent_reference.record_number)
+        log.debug('Real size of file: %d', entry.real_size_of_file)
+        log.debug('Flags: 0x%0X', entry.attr_flags)
 
-            # in documentation, this seems to be fixed offset
-            # however, this field seems to be wrong, because it's not always equal to 0x52 ...???
-            entry.offset_to_filename = 0x52
+        entry.filename_namespace = data.getBYTE(off + 0x51)
+        log.debug('Filename namespace: %s', entry.filename_namespace)
 
-            # file name from index (ie_filenname)
-            entry.filename = helper.Helper._widechar_to_ascii( data.getStream(off + entry.offset_to_filename, off + entry.offset_to_filename + entry.length_of_filename*2) )
-            log.debug('Filename: {}'.format(entry.filename))
+        entry.length_of_filename = data.getBYTE(off + 0x50)
+        log.debug('Length of the filename: 0x%0X', entry.length_of_filename)
 
-            # add entry object
-            entries.append(entry)
-            off += entry.length_index_entry 
+        entry.offset_to_filename = data.getWORD(off + 0x0a)
+        log.debug('Offset to filename: 0x%0X', entry.offset_to_filename)
 
-        return nodes, entries
+        # in documentation, this seems to be fixed offset
+        # however, this field seems to be wrong, because it's not always equal to 0x52 ...???
+        entry.offset_to_filename = 0x52
+
+        # file name from index (ie_filenname)
+        entry.filename = helper.Helper._widechar_to_ascii( data.getStream(off + entry.offset_to_filename, off + entry.offset_to_filename + entry.length_of_filename*2) )
+        log.debug('Filename: %s', entry.filename)
 
+        return entry
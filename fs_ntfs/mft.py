@@ -1,16 +1,71 @@
+import collections
+import concurrent.futures
+import itertools
 import logging
+import struct
 
 from . import DataModel
 
 from . import helper
 from . import filerecord
 from . import attributes
+from . import runlist
+from . import indexes
+from . import pathtable
 from . import ntfs
 
+# FILE record header, up to the next attribute id
+FILE_RECORD_HEADER = struct.Struct('<4sHHQHHHHIIQH')
+
+# size of the reads done when scanning the whole $MFT
+SCAN_CHUNK_SIZE = 4 * 1024 * 1024
+
+# file records handed to a worker process at once, in a parallel scan
+RECORDS_PER_JOB = 16384
+
+# bounds of the parsed file record cache, see MFT.get_file_record()
+RECORD_CACHE_ITEMS = 4096
+RECORD_CACHE_BYTES = 64 * 1024 * 1024
+
+# decoded runlists kept by MFT._decode_data_runs(), counted in runs
+RUNLIST_CACHE_RUNS = 1024 * 1024
+
+# bounds of the path lookup caches, see MFT.get_filerecord_of_path()
+DENTRY_CACHE_ITEMS  = 64 * 1024
+SYMLINK_CACHE_ITEMS = 4096
+
+# references found stale after the record was parsed again, see MFT.get_file_record()
+STALE_CACHE_ITEMS = 4096
+
+# cached negative lookups are stored as None
+_MISSING = object()
+
+# $UpCase file record, 65536 UTF-16 code units
+UPCASE_RECORD = 10
+UPCASE_SIZE   = 0x10000 * 2
+
+# a damaged record is skipped by the scans, not the whole scan (see iter_file_records()).
+# NtfsError (unknown attribute type, ...) is skipped as well
+RECORD_PARSE_ERRORS = (struct.error, TypeError, ValueError, IndexError)
+
+# rough in-memory footprint of one parsed index entry, used to weight cached directories
+INDEX_ENTRY_FOOTPRINT = 512
+
+# every worker process opens the image once, see MFT.map_file_records()
+_worker_ntfs = None
+
+def _scan_worker_init(data_model_class, source):
+    global _worker_ntfs
+    _worker_ntfs = ntfs.NTFS(data_model_class(source))
+
+def _scan_worker(job):
+    start, end, func, lazy, allocated = job
+    return [func(file_record) for file_record in _worker_ntfs.mft.iter_file_records(start, end, lazy=lazy, allocated=allocated)]
+
 class MFT(object):
     def __init__(self, boot, dataModel):
+        # level is inherited from the 'fs_ntfs' logger, see helper.Helper.set_debug()
         self.logger = logging.getLogger(__name__)
-        self.logger.setLevel(logging.DEBUG)
 
         self.dataModel = dataModel
 
@@ -41,6 +96,26 @@ class MFT(object):
             # ok
             pass
 
+        # parsed file records, directories are weighted by their index entries
+        self._records = helper.LRUCache(max_items=RECORD_CACHE_ITEMS, max_bytes=RECORD_CACHE_BYTES)
+
+        # (record, sequence number) -> the cached record it did not match
+        self._stale_refs = helper.LRUCache(max_items=STALE_CACHE_ITEMS)
+
+        # decoded mapping pairs, keyed by their raw bytes
+        self._runlists = helper.LRUCache(max_bytes=RUNLIST_CACHE_RUNS)
+
+        # $UpCase translation table, see get_upcase_table()
+        self._upcase = None
+
+        # $MFT:$BITMAP, see get_mft_bitmap()
+        self._mft_bitmap = None
+
+        # path lookups: (directory, name) -> child reference or None if not there,
+        # and symlink -> target reference
+        self._dentries = helper.LRUCache(max_items=DENTRY_CACHE_ITEMS)
+        self._symlinks = helper.LRUCache(max_items=SYMLINK_CACHE_ITEMS)
+
     def _get_le(self, s):
         n = 0x00
 
@@ -67,74 +142,63 @@ class MFT(object):
 
         i = 0
 
-        log.debug('FILE_RECORD #{0}'.format(i))
+        log.debug('FILE_RECORD #%s', i)
 
         file_record = start_mft + i*file_record_size
         fr = file_record
-        off_first_attr = self.dataModel.getWORD(file_record+0x14)
-
 
         data = self.dataModel
 
-        real_size = data.getDWORD(fr + 0x18)
-        log.debug('Real size of file record: 0x{:1X}'.format(real_size))
+        (magic, offset_update_seq, size_update_seq, lsn, seq_number, hard_link_count,
+         off_first_attr, flags, real_size, allocated_size, file_reference, next_attribute_id) = data.unpack(FILE_RECORD_HEADER, fr)
 
-        allocated_size = data.getDWORD(fr + 0x1c)
-        log.debug('Allocated size of file record: 0x{:0X}'.format(allocated_size))
-
-        file_reference = data.getQWORD(fr + 0x20)
-        log.debug('File reference to the base FILE record: 0x{:0X}'.format(file_reference))
-
-        next_attribute_id = data.getWORD(fr + 0x28)
-        log.debug('Next Attribute Id: 0x{:0X}'.format(next_attribute_id))
+        log.debug('Real size of file record: 0x%1X', real_size)
+        log.debug('Allocated size of file record: 0x%0X', allocated_size)
+        log.debug('File reference to the base FILE record: 0x%0X', file_reference)
+        log.debug('Next Attribute Id: 0x%0X', next_attribute_id)
 
         ao = fr + off_first_attr 
         while 1:
-            std_attr_type = data.getDWORD(ao + 0x00)
-            if std_attr_type == 0xFFFFFFFF:
+            header = data.unpack(attributes.ATTRIBUTE_HEADER, ao)
+            if header is None or header[0] == 0xFFFFFFFF:
                 # attribute list ends
                 break
 
-            attr_length = data.getDWORD(ao + 0x04)
-            non_resident_flag = data.getBYTE(ao + 0x08)
-            attr_name_length = data.getBYTE(ao + 0x09)
+            std_attr_type, attr_length, non_resident_flag, attr_name_length = header[:4]
 
             if non_resident_flag and not attr_name_length and std_attr_type == 0x80:
                 # $DATA
-                starting_vcn = data.getQWORD(ao + 0x10)
-                last_vcn = data.getQWORD(ao + 0x18)
+                (starting_vcn, last_vcn, offset_to_attribute, compression_unit, _,
+                 attr_allocated_size, attr_real_size, attr_initialized_size) = data.unpack(attributes.NON_RESIDENT_HEADER, ao + 0x10)
 
-                log.debug('Starting VCN: 0x{:0X}, last VCN: 0x{:0X}'.format(starting_vcn, last_vcn))
+                log.debug('Starting VCN: 0x%0X, last VCN: 0x%0X', starting_vcn, last_vcn)
 
-                attr_real_size = data.getQWORD(ao + 0x30)
-                log.debug('Real size of the attribute: 0x{:0X}'.format(attr_real_size))
+                log.debug('Real size of the attribute: 0x%0X', attr_real_size)
                 attr_length_2 = attr_real_size
 
-                # offset to datarun
-                offset_to_attribute = data.getWORD(ao + 0x20) 
-
                 log.debug('data runs...')
                 s = data.getStream(ao + offset_to_attribute, ao + offset_to_attribute + attr_length - 0x40)
 
-                _log = ''
-                for k in s:
-                    _log += '0x{:02x}'.format(k) + ' '
-                    
-
-                log.debug(_log)
-                log.debug('')
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug(' '.join('0x{:02x}'.format(k) for k in s))
+                    log.debug('')
 
                 data_runs = self._decode_data_runs(s)
 
-                for data_run in data_runs:
-                    n, lcn = data_run
+                if log.isEnabledFor(logging.DEBUG):
+                    for data_run in data_runs:
+                        n, lcn = data_run
+                        if lcn is None:
+                            log.debug('0x%04x clusters, sparse', n)
+                            continue
 
-                    file_offset = lcn * self.sectors_per_cluster * self.bytes_per_sector
-                    size_in_bytes = n * self.sectors_per_cluster * self.bytes_per_sector
+                        file_offset = lcn * self.sectors_per_cluster * self.bytes_per_sector
+                        size_in_bytes = n * self.sectors_per_cluster * self.bytes_per_sector
 
-                    log.debug('0x{:04x} clusters @ LCN 0x{:08x}, @ f_offset 0x{:x}, size_in_bytes {:,}'.format(n, lcn, file_offset, size_in_bytes))
+                        log.debug('0x%04x clusters @ LCN 0x%08x, @ f_offset 0x%x, size_in_bytes %d', n, lcn, file_offset, size_in_bytes)
 
                 self.mft_data_runs = data_runs
+                self.mft_size = attr_real_size
                 return data_runs
 
             ao += attr_length
@@ -143,15 +207,25 @@ class MFT(object):
         return None
 
     def _decode_data_runs(self, stream):
+        # mapping pairs -> RunList, memoized on the raw bytes, so the same attribute
+        # read again (record evicted from the cache, or another parse) is not decoded twice
+        key = bytes(stream)
+
+        data_runs = self._runlists.get(key)
+        if data_runs is not None:
+            return data_runs
+
         log = self.logger
+        debug = log.isEnabledFor(logging.DEBUG)
 
-        s = stream
         result = []
 
         prev_lcn_start = 0
-        while 1:
-            #print '0x{:02x}'.format(k),
-            k = s[0]
+        offset = 0
+        size = len(key)
+
+        while offset < size:
+            k = key[offset]
 
             if k == 0x00:
                 break
@@ -159,52 +233,55 @@ class MFT(object):
             length_size = k & 0x0F
             offset_size = (k & 0xF0) >> 4
 
-            if offset_size == 0x00:
-                # sparse file
-                # !FIXME, should we do something with it?
+            offset += 1
+            if offset + length_size + offset_size > size:
+                log.warning('truncated data run at offset 0x%x', offset - 1)
                 break
 
-            n_clusters = self._get_le(s[1:1 + length_size])
-            rel_lcn_start  = self._get_le(s[1 + length_size: 1 + length_size + offset_size])
+            n_clusters = int.from_bytes(key[offset:offset + length_size], 'little')
+            offset += length_size
 
-            lcn_start  = prev_lcn_start + rel_lcn_start
+            if offset_size == 0x00:
+                # sparse run, a hole of n_clusters with no LCN; next relative LCN is still from prev_lcn_start
+                result.append((n_clusters, None))
 
-            """
-            log.debug('...data runs...')
+                if debug:
+                    log.debug('sparse, length_size: 0x%x, n_clusters: 0x%04x', length_size, n_clusters)
 
-            q = ''
-            for k in stream:
-                q += '0x{:02x} '.format(k)
+                continue
 
-            log.debug(q)
-            """
+            rel_lcn_start = int.from_bytes(key[offset:offset + offset_size], 'little', signed=True)
+            offset += offset_size
 
-            log.debug('LCN relative 0x{:08x}, length_size: 0x{:x}, offset_size: 0x{:x}, n_clusters: 0x{:04x}, LCN start: 0x{:04x}'.format(rel_lcn_start, length_size, offset_size, n_clusters, lcn_start))
+            lcn_start = prev_lcn_start + rel_lcn_start
 
-            s = s[1 + length_size + offset_size:]
+            if debug:
+                log.debug('LCN relative 0x%08x, length_size: 0x%x, offset_size: 0x%x, n_clusters: 0x%04x, LCN start: 0x%04x', rel_lcn_start, length_size, offset_size, n_clusters, lcn_start)
 
-            result += [(n_clusters, lcn_start)]
+            result.append((n_clusters, lcn_start))
             prev_lcn_start = lcn_start
 
-        log.debug('')
+        data_runs = runlist.RunList(result)
+        self._runlists.put(key, data_runs, max(1, len(result)))
 
-        return result
+        return data_runs
 
     def _datarun_of_file_record(self, which_file_record):
+        # data run holding file_record, and the record number relative to that run
+        bytes_per_cluster = self.sectors_per_cluster * self.bytes_per_sector
 
-        # get data run of file_record
-        for n, lcn in self.mft_data_runs:
-            start_mft = lcn * self.sectors_per_cluster * self.bytes_per_sector
-            mft_size_in_bytes = n * self.sectors_per_cluster * self.bytes_per_sector
+        offset = which_file_record * self.file_record_size
 
-            n_file_records = mft_size_in_bytes // self.file_record_size
+        found = self.mft_data_runs.find_vcn(offset // bytes_per_cluster)
+        if found is None:
+            return None
 
-            if which_file_record < n_file_records:
-                return (n, lcn, which_file_record)
-            else:
-                which_file_record -= n_file_records
+        (n, lcn), rel_vcn = found
 
-        return None
+        # byte offset of the run inside $MFT
+        run_offset = (offset // bytes_per_cluster - rel_vcn) * bytes_per_cluster
+
+        return (n, lcn, (offset - run_offset) // self.file_record_size)
 
     def _build_attrdef(self):
         datarun = self._datarun_of_file_record(4)
@@ -217,7 +294,7 @@ class MFT(object):
         start_mft = lcn * self.sectors_per_cluster * self.bytes_per_sector
         mft_size_in_bytes = n * self.sectors_per_cluster * self.bytes_per_sector
 
-        file_record = start_mft + 4*self.file_record_size
+        file_record = start_mft + rel_record*self.file_record_size
 
         log = self.logger
 
@@ -230,14 +307,12 @@ class MFT(object):
 
         # iterate attributes
         while 1:
-            std_attr_type = data.getDWORD(ao + 0x00)
-            if std_attr_type == 0xFFFFFFFF:
+            header = data.unpack(attributes.ATTRIBUTE_HEADER, ao)
+            if header is None or header[0] == 0xFFFFFFFF:
                 break
 
             # standard attribute header
-            attr_length = data.getDWORD(ao + 0x04)
-            non_resident_flag = data.getBYTE(ao + 0x08)
-            attr_name_length = data.getBYTE(ao + 0x09)
+            std_attr_type, attr_length, non_resident_flag, attr_name_length = header[:4]
 
             if non_resident_flag and not attr_name_length and std_attr_type == 0x80:
                 # $DATA
@@ -252,6 +327,9 @@ class MFT(object):
 
                 for data_run in data_runs:
                     n, lcn = data_run
+                    if lcn is None:
+                        log.debug('0x%04x clusters, sparse', n)
+                        continue
 
                     file_offset = lcn * self.sectors_per_cluster * self.bytes_per_sector
                     size_in_bytes = n * self.sectors_per_cluster * self.bytes_per_sector
@@ -277,8 +355,9 @@ class MFT(object):
             ao += attr_length
 
         log.debug('=====================     Dumping $AttrDef...     =====================')
-        for a in _attrDef.getAttributes():
-            log.debug('Attribute: {:30} type: 0x{:03X}, flags: 0x{:02X}'.format(a.name, a.type, a.flags))
+        if log.isEnabledFor(logging.DEBUG):
+            for a in _attrDef.getAttributes():
+                log.debug('Attribute: {:30} type: 0x{:03X}, flags: 0x{:02X}'.format(a.name, a.type, a.flags))
 
         log.debug('')
 
@@ -298,11 +377,65 @@ class MFT(object):
 
         return start_mft, mft_size_in_bytes
 
-    def get_file_record(self, which_file_record):
-        log = helper.Helper.logger()
+    def get_file_record(self, which_file_record, seq_number=None, lazy=False):
+        # parsed records are cached. if the caller knows the sequence number (from a file
+        # reference) and it does not match, the slot was reused and the record is parsed again.
+        # if it still does not match, the reference is stale: None, the new record stays cached.
+        # a lazy record only indexes attribute headers, attributes are built on first access.
+        obj = self._records.get(which_file_record)
+        if obj is not None:
+            if seq_number is None or seq_number == obj.seq_number:
+                return obj
 
-        log.debug('==================== [File record #{}] ===================='.format(which_file_record))
+            if self._stale_refs.get((which_file_record, seq_number)) is obj:
+                return None
+
+            self.logger.debug('file record #%s sequence number changed: 0x%x -> 0x%x', which_file_record, obj.seq_number, seq_number)
+            self._records.invalidate(which_file_record)
+
+        obj = self._read_file_record(which_file_record, lazy)
+        if obj is None:
+            return None
 
+        self._records.put(which_file_record, obj, self._estimate_size(obj))
+
+        if seq_number is not None and seq_number != obj.seq_number:
+            self.logger.debug('file record #%s has sequence number 0x%x, stale reference 0x%x', which_file_record, obj.seq_number, seq_number)
+            self._stale_refs.put((which_file_record, seq_number), obj)
+            return None
+
+        return obj
+
+    def invalidate_cache(self, which_file_record=None):
+        # drop one record from the cache, or all of them. path lookups can go through
+        # any record, they are all dropped
+        self._records.invalidate(which_file_record)
+
+        self._dentries.invalidate()
+        self._symlinks.invalidate()
+
+    def cache_stats(self):
+        return self._records.stats()
+
+    def dentry_stats(self):
+        # path lookup caches
+        return {'dentries': self._dentries.stats(),
+                'symlinks': self._symlinks.stats()}
+
+    def update_cache_size(self, file_record):
+        # called once a cached record built its index entries, so they count in the byte budget
+        self._records.resize(file_record.inode, file_record, self._estimate_size(file_record))
+
+    def _estimate_size(self, file_record):
+        # the record buffer plus the index entries it holds (only if already built)
+        size = self.file_record_size
+
+        for index in file_record._attributes_dict.get('$INDEX_ROOT', []):
+            size += len(index.loaded_entries()) * INDEX_ENTRY_FOOTPRINT
+
+        return size
+
+    def _read_file_record(self, which_file_record, lazy=False):
         datarun = self._datarun_of_file_record(which_file_record)
         if datarun is None:
             # file record not found
@@ -315,67 +448,217 @@ class MFT(object):
 
         file_record_offset = start_mft + rel_record*self.file_record_size
 
-        # simple check
         fr = file_record_offset
+        return self._parse_file_record(which_file_record, fr, self.dataModel.getStream(fr, fr + self.file_record_size), lazy)
+
+    def get_mft_bitmap(self):
+        # $MFT:$BITMAP as a bitmap.Bitset, bit k is set if file record #k is in use. read once,
+        # None if $MFT has no $BITMAP
+        if self._mft_bitmap is None:
+            n_file_records = self.mft_size // self.file_record_size
+
+            fr = self.get_file_record(0, lazy=True)
+            bitmaps = fr.get_attribute('$BITMAP') if fr is not None else None
+
+            if not bitmaps:
+                self.logger.debug('$MFT has no $BITMAP.')
+                return None
+
+            self._mft_bitmap = bitmaps[0].get_bitset(n_file_records)
+
+        return self._mft_bitmap
+
+    def _scan_extents(self, start, end, allocated):
+        # record ranges [a, b) to read: all of [start, end), or only the records that are
+        # in use (allocated=True) or free (allocated=False) in the $MFT bitmap
+        if allocated is None:
+            return [(start, end)]
+
+        bits = self.get_mft_bitmap()
+        if bits is None:
+            return [(start, end)]
+
+        return [(a, a + n) for a, n in bits.extents(allocated, start, end)]
+
+    def iter_file_records(self, start=0, end=None, chunk_size=SCAN_CHUNK_SIZE, lazy=False, allocated=None):
+        # visit file records [start, end) in record order, reading $MFT extent by extent
+        # in big sequential chunks. slots that do not hold a FILE record are skipped.
+        # with allocated=True only records in use are read, allocated=False reads only
+        # the free ones (recovery); unused extents are skipped without reading them.
+        # metadata-only scans should use lazy records.
+        log = self.logger
+
+        bytes_per_cluster = self.sectors_per_cluster * self.bytes_per_sector
+        file_record_size = self.file_record_size
+
+        n_file_records = self.mft_size // file_record_size
+        if end is None or end > n_file_records:
+            end = n_file_records
+
+        records_per_chunk = max(1, chunk_size // file_record_size)
+
+        # first record number of the current data run
+        first = 0
+        for n, lcn in self.mft_data_runs:
+            if first >= end:
+                break
+
+            run_records = n * bytes_per_cluster // file_record_size
+
+            for k, last in self._scan_extents(max(start, first), min(end, first + run_records), allocated):
+                while k < last:
+                    count = min(records_per_chunk, last - k)
+                    offset = lcn * bytes_per_cluster + (k - first) * file_record_size
+
+                    log.debug('scan: records #%s..#%s @ f_offset 0x%x', k, k + count - 1, offset)
+
+                    chunk = memoryview(self.dataModel.getStream(offset, offset + count * file_record_size))
+
+                    for i in range(count):
+                        # copy out the record, parsed records do not keep the chunk alive
+                        record = bytearray(chunk[i * file_record_size:(i + 1) * file_record_size])
+
+                        try:
+                            obj = self._parse_file_record(k + i, offset + i * file_record_size, record, lazy)
+                        except (ntfs.NtfsError,) + RECORD_PARSE_ERRORS as e:
+                            log.warning('scan: file record #%s skipped, %s', k + i, e)
+                            continue
+
+                        if obj is not None:
+                            yield obj
+
+                    k += count
+
+            first += run_records
+
+    def map_file_records(self, func, jobs=1, start=0, end=None, records_per_job=RECORDS_PER_JOB, lazy=False, allocated=None):
+        # yields func(file_record) for file records [start, end), in record order.
+        # with jobs > 1, contiguous record ranges are parsed by a pool of worker processes,
+        # each one with its own data model. func must be picklable (module level) and so
+        # must be its results, file records can not leave the worker.
+        # allocated works as in iter_file_records().
+        log = self.logger
+
+        if jobs > 1 and not isinstance(self.dataModel, (DataModel.FileDataModel, DataModel.MappedFileDataModel)):
+            log.debug('parallel scan needs a file backed data model, scanning serially.')
+            jobs = 1
+
+        if jobs <= 1:
+            for file_record in self.iter_file_records(start, end, lazy=lazy, allocated=allocated):
+                yield func(file_record)
+
+            return
+
+        work = ((a, b, func, lazy, allocated) for a, b in self._partition_file_records(start, end, records_per_job, allocated))
+
+        with concurrent.futures.ProcessPoolExecutor(jobs, initializer=_scan_worker_init,
+                                                    initargs=(type(self.dataModel), self.dataModel.source)) as pool:
+
+            # keep a bounded number of ranges in flight, results are merged in order
+            pending = collections.deque(pool.submit(_scan_worker, job) for job in itertools.islice(work, 2 * jobs))
+
+            while pending:
+                results = pending.popleft().result()
 
-        obj = filerecord.FileRecord(self)
+                job = next(work, None)
+                if job is not None:
+                    pending.append(pool.submit(_scan_worker, job))
+
+                for result in results:
+                    yield result
+
+    def _partition_file_records(self, start=0, end=None, records_per_job=RECORDS_PER_JOB, allocated=None):
+        # split [start, end) in contiguous ranges, never crossing a $MFT data run.
+        # ranges without any record to read (see allocated) are left out
+        bytes_per_cluster = self.sectors_per_cluster * self.bytes_per_sector
+
+        n_file_records = self.mft_size // self.file_record_size
+        if end is None or end > n_file_records:
+            end = n_file_records
+
+        bits = None
+        if allocated is not None:
+            bits = self.get_mft_bitmap()
+
+        ranges = []
+
+        first = 0
+        for n, lcn in self.mft_data_runs:
+            run_records = n * bytes_per_cluster // self.file_record_size
+
+            k = max(start, first)
+            last = min(end, first + run_records)
+
+            while k < last:
+                b = min(k + records_per_job, last)
+
+                if bits is not None:
+                    # start the range at its first record to read
+                    k = bits.find(allocated, k)
+                    if k is None or k >= last:
+                        break
+
+                    b = min(k + records_per_job, last)
+
+                ranges += [(k, b)]
+                k = b
+
+            first += run_records
+
+        return ranges
+
+    def _parse_file_record(self, which_file_record, offset, record, lazy=False):
+        log = helper.Helper.logger()
+
+        log.debug('==================== [File record #%s] ====================', which_file_record)
+
+        fr = offset
+
+        obj = filerecord.FileRecord(self, lazy)
         obj.offset = fr
         obj.size = self.file_record_size
 
         # get buffered data model
-        data = DataModel.BufferDataModel(self.dataModel.getStream(fr, fr + self.file_record_size), 'file_record')
+        data = DataModel.BufferDataModel(record, 'file_record')
         fr = 0
 
         magic = data.getStream(fr + 0x00, fr + 0x04)
      
         if magic != b"FILE":
-            log.debug('magic does not mach "FILE", instead: {}.'.format(magic))
+            log.debug('magic does not mach "FILE", instead: %s.', magic)
             return None
             #raise NtfsError('magic should mach "FILE", offset 0x{:x}'.format(fr))
 
+        # whole header in one go
+        (magic, offset_update_seq, size_update_seq, lsn, seq_number, hard_link_count,
+         off_first_attr, flags, real_size, allocated_size, file_reference, next_attribute_id) = data.unpack(FILE_RECORD_HEADER, fr)
 
-        offset_update_seq = data.getWORD(fr + 0x04)
-        log.debug('Offset to update sequence: 0x{:0x}'.format(offset_update_seq))
-
-        size_update_seq = data.getWORD(fr + 0x06)
-        log.debug('Size in words of update sequence: 0x{:0x}'.format(size_update_seq))
+        log.debug('Offset to update sequence: 0x%0x', offset_update_seq)
+        log.debug('Size in words of update sequence: 0x%0x', size_update_seq)
 
         update_seq = data.getWORD(fr + offset_update_seq)
-        log.debug('Update Sequence number: 0x{:04x}'.format(update_seq))
+        log.debug('Update Sequence number: 0x%04x', update_seq)
 
         # skip update seq number
         update_seq_array = data.getStream(fr + offset_update_seq + 2, fr + offset_update_seq + 2 + size_update_seq * 2)
 
-        g = 'Update Sequence: '
-        for x in update_seq_array:
-            g += '{:02x} '.format(x)
-            
-        log.debug('{}'.format(g))
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug('Update Sequence: %s', ' '.join('{:02x}'.format(x) for x in update_seq_array))
 
         # fixup things
         ntfs.NTFS.fixup_seq_numbers(data, update_seq_array, size_update_seq, update_seq, self.bytes_per_sector)
 
-
-        off_first_attr = data.getWORD(fr + 0x14)
-
-        flags = data.getWORD(fr + 0x16)
-        log.debug('Flags: 0x{:0X}'.format(flags))
-
-        real_size = data.getDWORD(fr + 0x18)
-        log.debug('Real size of file record: 0x{:1X}'.format(real_size))
-
-        allocated_size = data.getDWORD(fr + 0x1c)
-        log.debug('Allocated size of file record: 0x{:0X}'.format(allocated_size))
-
-        file_reference = data.getQWORD(fr + 0x20)
-        log.debug('File reference to the base FILE record: 0x{:0X}'.format(file_reference))
-
-        next_attribute_id = data.getWORD(fr + 0x28)
-        log.debug('Next Attribute Id: 0x{:0X}'.format(next_attribute_id))
+        log.debug('Sequence number: 0x%0X', seq_number)
+        log.debug('Flags: 0x%0X', flags)
+        log.debug('Real size of file record: 0x%1X', real_size)
+        log.debug('Allocated size of file record: 0x%0X', allocated_size)
+        log.debug('File reference to the base FILE record: 0x%0X', file_reference)
+        log.debug('Next Attribute Id: 0x%0X', next_attribute_id)
 
         log.debug('')
 
         obj.inode = which_file_record
+        obj.seq_number = seq_number
         obj.off_first_attr = off_first_attr
         obj.flags = flags
         obj.real_size = real_size
@@ -389,130 +672,131 @@ class MFT(object):
 
         ao = fr + off_first_attr 
 
+        # attributes stay in the used part of the record
+        used = real_size if off_first_attr < real_size <= data.size() else data.size()
+
         log.debug('---=== attributes ===---')
         while 1:
             attribute = attributes.Attribute(data, ao)
 
-            std_attr_type = data.getDWORD(ao + 0x00)
-            if std_attr_type == 0xFFFFFFFF:
+            header = data.unpack(attributes.ATTRIBUTE_HEADER, ao)
+            if header is None or header[0] == 0xFFFFFFFF:
                 break
 
-            # standard attribute header
-            log.debug('Attribute type: {0}'.format(self.AttrDef.getByType(std_attr_type).name))
+            std_attr_type, attr_length, non_resident_flag, attr_name_length, name_offset, attr_flags, attribute_id = header
+
+            if attr_length == 0 or ao + attr_length > used:
+                log.warning('file record #%s: bad attribute length 0x%x @ 0x%x, attributes not read further.', which_file_record, attr_length, ao)
+                break
 
-            attr_length = data.getDWORD(ao + 0x04)
-            log.debug('Length: 0x{:0X}'.format(attr_length))
+            attrdef = self.AttrDef.getByType(std_attr_type)
 
-            non_resident_flag = data.getBYTE(ao + 0x08)
+            # standard attribute header
+            log.debug('Attribute type: %s', attrdef.name)
+            log.debug('Length: 0x%0X', attr_length)
+            log.debug('Non-resident flag: 0x%0X, name length: 0x%0X', non_resident_flag, attr_name_length)
+
+            if non_resident_flag:
+                fields = data.unpack(attributes.NON_RESIDENT_HEADER, ao + 0x10)
+            else:
+                fields = data.unpack(attributes.RESIDENT_HEADER, ao + 0x10)
 
-            attr_name_length = data.getBYTE(ao + 0x09)
+            if fields is None:
+                log.warning('file record #%s: truncated attribute header @ 0x%x, attributes not read further.', which_file_record, ao)
+                break
 
-            log.debug('Non-resident flag: 0x{:0X}, name length: 0x{:0X}'.format(non_resident_flag, attr_name_length))
+            if non_resident_flag:
+                (starting_vcn, last_vcn, offset_to_runs, compression_unit, _,
+                 attr_allocated_size, attr_real_size, attr_initialized_size) = fields
+            else:
+                attr_length_2, offset_to_attribute, indexed_flag, _ = fields
 
             # build instance
 
             attribute.std_header.type = std_attr_type
-            attribute.std_header.attrdef = self.AttrDef.getByType(std_attr_type)
+            attribute.std_header.attrdef = attrdef
             attribute.std_header.length = attr_length
             attribute.std_header.non_resident_flag = non_resident_flag
             attribute.std_header.name_length = attr_name_length
 
             if not non_resident_flag and not attr_name_length:
-                log.debug('Attribute is: {}'.format('resident, not named'))
-
-                offset_to_attribute = data.getWORD(ao + 0x14)
-                attr_length_2 = data.getDWORD(ao + 0x10)
+                log.debug('Attribute is: resident, not named')
 
-                log.debug('Length of the attribute: 0x{:0X}'.format(attr_length_2))
+                log.debug('Length of the attribute: 0x%0X', attr_length_2)
                 attr_name = ''
 
                 # data is resident, so this will be length of data
                 attribute.std_header.attr_real_size = attr_length_2
 
             if not non_resident_flag and  attr_name_length:
-                log.debug('Attribute is: {}'.format('resident, named'))
-
-                offset_to_attribute = data.getWORD(ao + 0x14)
+                log.debug('Attribute is: resident, named')
 
                 attr_name = data.getStream(ao + 0x18, ao + 0x18 + 2 * attr_name_length)
                 attr_name = helper.Helper._widechar_to_ascii(attr_name)
 
-                log.debug('Attribute name: {0}'.format(attr_name))
+                log.debug('Attribute name: %s', attr_name)
 
-                attr_length_2 = data.getDWORD(ao + 0x10)
-                log.debug('Length of the attribute: 0x{:0X}'.format(attr_length_2))
+                log.debug('Length of the attribute: 0x%0X', attr_length_2)
 
                 # data is resident, so this will be length of data
                 attribute.std_header.attr_real_size = attr_length_2
 
             if non_resident_flag and not attr_name_length:
 
-                log.debug('Attribute is: {}'.format('non resident, not named'))
+                log.debug('Attribute is: non resident, not named')
 
-                starting_vcn = data.getQWORD(ao + 0x10)
-                last_vcn = data.getQWORD(ao + 0x18)
-                log.debug('Starting VCN: 0x{:0X}, last VCN: 0x{:0X}'.format(starting_vcn, last_vcn))
+                log.debug('Starting VCN: 0x%0X, last VCN: 0x%0X', starting_vcn, last_vcn)
 
-                attr_real_size = data.getQWORD(ao + 0x30)
-                log.debug('Real size of the attribute: 0x{:0X}'.format(attr_real_size))
+                log.debug('Real size of the attribute: 0x%0X', attr_real_size)
                 attr_length_2 = attr_real_size
 
                 # offset to datarun
-                offset_to_attribute = data.getWORD(ao + 0x20) 
+                offset_to_attribute = offset_to_runs
                 attr_name = ''
 
                 attribute.std_header.start_vcn = starting_vcn
                 attribute.std_header.last_vcn = last_vcn
                 attribute.std_header.attr_real_size = attr_real_size
+                attribute.std_header.attr_allocated_size = attr_allocated_size
 
-                s = data.getStream(ao + offset_to_attribute, ao + offset_to_attribute + attr_length - 0x40)
-                data_runs = self._decode_data_runs(s)
-
-                attribute.data_runs = data_runs
-
-                for data_run in data_runs:
-                    n, lcn = data_run
-
-                    file_offset = lcn * self.sectors_per_cluster * self.bytes_per_sector
-                    size_in_bytes = n * self.sectors_per_cluster * self.bytes_per_sector
-
-                    log.debug('0x{:04x} clusters @ LCN 0x{:08x}, @ f_offset 0x{:x}, size_in_bytes {:,}'.format(n, lcn, file_offset, size_in_bytes))
+                # data runs are decoded on first use
+                attribute.set_data_runs_stream(self, ao + offset_to_attribute, ao + offset_to_attribute + attr_length - 0x40)
 
             if non_resident_flag and  attr_name_length:
-                log.debug('Attribute is: {}'.format('non resident, named'))
+                log.debug('Attribute is: non resident, named')
 
-                starting_vcn = data.getQWORD(ao + 0x10)
-                last_vcn = data.getQWORD(ao + 0x18)
-                log.debug('Starting VCN: 0x{:0X}, last VCN: 0x{:0X}'.format(starting_vcn, last_vcn))
+                log.debug('Starting VCN: 0x%0X, last VCN: 0x%0X', starting_vcn, last_vcn)
 
                 attr_name = data.getStream(ao + 0x40, ao + 0x40 + 2 * attr_name_length)
                 attr_name = helper.Helper._widechar_to_ascii(attr_name)
                 
-                log.debug('Attribute name: {0}'.format(attr_name))
+                log.debug('Attribute name: %s', attr_name)
 
-                attr_real_size = data.getQWORD(ao + 0x30)
-                log.debug('Real size of the attribute: 0x{:0X}'.format(attr_real_size))
+                log.debug('Real size of the attribute: 0x%0X', attr_real_size)
                 attr_length_2 = attr_real_size
 
                 attribute.std_header.start_vcn = starting_vcn
                 attribute.std_header.last_vcn = last_vcn
                 attribute.std_header.attr_real_size = attr_real_size
+                attribute.std_header.attr_allocated_size = attr_allocated_size
 
                 # offset to datarun
-                offset_to_attribute = data.getWORD(ao + 0x20) 
-
-                s = data.getStream(ao + offset_to_attribute, ao + offset_to_attribute + attr_length - (2 * attr_name_length + 0x40))
-                data_runs = self._decode_data_runs(s)
+                offset_to_attribute = offset_to_runs
 
-                attribute.data_runs = data_runs                
+                # data runs are decoded on first use
+                attribute.set_data_runs_stream(self, ao + offset_to_attribute, ao + offset_to_attribute + attr_length - (2 * attr_name_length + 0x40))
 
-                for data_run in data_runs:
+            if non_resident_flag and not lazy and log.isEnabledFor(logging.DEBUG):
+                for data_run in attribute.data_runs:
                     n, lcn = data_run
+                    if lcn is None:
+                        log.debug('0x%04x clusters, sparse', n)
+                        continue
 
                     file_offset = lcn * self.sectors_per_cluster * self.bytes_per_sector
                     size_in_bytes = n * self.sectors_per_cluster * self.bytes_per_sector
 
-                    log.debug('0x{:04x} clusters @ LCN 0x{:08x}, @ f_offset 0x{:x}, size_in_bytes {:,}'.format(n, lcn, file_offset, size_in_bytes))
+                    log.debug('0x%04x clusters @ LCN 0x%08x, @ f_offset 0x%x, size_in_bytes %d', n, lcn, file_offset, size_in_bytes)
 
 
             # populate std_header
@@ -525,24 +809,93 @@ class MFT(object):
 
             ao += attr_length
 
-            attribute.obj = attributes.AttributeTypeFactory.recognize(attribute, obj)
-            if attribute.obj is None:
-                self.logger.debug('Attribute {} (0x{:x}) not supported yet.'.format(attribute.std_header.attrdef.name, attribute.std_header.attrdef.type))
-                self.logger.debug('')
-
-            obj.add_attribute(attribute)
+            # only the header is indexed here, type objects are built by FileRecord
+            obj.add_pending_attribute(attribute)
 
         log.debug('---=== end attributes ===---')
 
-        # postprocessing
-        log.debug('postprocessing....')
-        for attribute in obj.attributes:
-            if attribute.obj:
-                attribute.obj.postprocess()
+        if not lazy:
+            # build all attributes and postprocess them
+            obj.materialize()
 
         log.debug('')
         return obj
 
+    def get_upcase_table(self):
+        # $UpCase as a 65536 chars translation table for indexes.filename_key(), read once.
+        # volumes without a usable $UpCase fall back to the unicode database
+        if self._upcase is None:
+            log = self.logger
+
+            upcase = None
+
+            fr = self.get_file_record(UPCASE_RECORD, lazy=True)
+            if fr is not None and fr.get_displayed_filename() == '$UpCase':
+                data = b''.join(bytes(chunk) for chunk in fr.get_file_data())
+                if len(data) >= UPCASE_SIZE:
+                    # code unit by code unit, surrogates must not pair up
+                    upcase = ''.join(map(chr, struct.unpack_from('<%dH' % (UPCASE_SIZE // 2), data)))
+
+            if upcase is None:
+                log.debug('$UpCase not found, using default upcase table.')
+                upcase = indexes.default_upcase_table()
+
+            self._upcase = upcase
+
+        return self._upcase
+
+    def stat(self, path, ignore_case=False):
+        # indexes.FileStat of path, from the index entry in its parent directory: only the
+        # directories on the way are read, not the file itself. symlinks are not followed
+        path = path.strip('\\')
+        if not path:
+            root = self.get_file_record(5, lazy=True)
+            return root.stat() if root is not None else None
+
+        parent, _, name = path.rpartition('\\')
+
+        if parent:
+            directory = self.get_filerecord_of_path(parent, ignore_case)
+        else:
+            directory = self.get_file_record(5, lazy=True)
+
+        if directory is None:
+            return None
+
+        entry = directory.find_entries([name], ignore_case).get(name)
+        if entry is None:
+            return None
+
+        return entry.stat()
+
+    def get_path_table(self, jobs=1, allocated=None):
+        # record -> full path for the whole volume, from one scan of the $MFT
+        return pathtable.PathTable.from_mft(self, jobs=jobs, allocated=allocated)
+
+    def _resolve_symlink(self, file_record, ignore_case=False):
+        # file record the symlink points to, memoized
+        key = (file_record.inode, file_record.seq_number, ignore_case)
+
+        target = self._symlinks.get(key, _MISSING)
+        if target is _MISSING:
+            symlink = file_record.get_reparse_point()
+            if symlink is None:
+                # not a symlink (or not one we understand)
+                return file_record
+
+            fo = self.get_filerecord_of_path(symlink, ignore_case)
+
+            target = None
+            if fo is not None:
+                target = (fo.inode, fo.seq_number)
+
+            self._symlinks.put(key, target)
+
+        if target is None:
+            return None
+
+        return self.get_file_record(target[0], target[1], lazy=True)
+
     def get_reparse_points(self):
         log = helper.Helper().logger()
 
@@ -557,76 +910,108 @@ class MFT(object):
             if index.attribute.std_header.name == '$R':
                 for entry in index.entries:
                     record_number = entry.mft_file_record.record_number
-                    fr = self.get_file_record(record_number)
+                    fr = self.get_file_record(record_number, entry.mft_file_record.seq_number)
                     if fr is None:
-                        log.debug("File record #{} referenced in $Reparse not found!".format(record_number))
+                        log.debug("File record #%s referenced in $Reparse not found!", record_number)
+                        continue
 
                     D += [(record_number, fr.get_displayed_filename(), fr.get_reparse_point())]
 
         return D
 
-    def get_filerecord_of_path(self, path):
+    def get_filerecord_of_path(self, path, ignore_case=False):
         # we accept windows path
 
-        # this is not an efficient implementation, because all antries are already fetched
-        # so we are not using b-trees here actually. everything is fetched when get_file_record
-        # is used. Anyway, this is not for speed, is mainly for investigating/research/play/whatever
+        # every component is looked up by descending the $I30 b-tree of its directory,
+        # only the INDX blocks on the search path are read. records are parsed lazily.
+        # names collate with the volume $UpCase, ignore_case matches them like windows does.
 
         log = helper.Helper().logger()
 
         log.debug('')
-        log.debug('traversing path: {}'.format(path))
+        log.debug('traversing path: %s', path)
 
         path = path.split('\\')
 
+        upcase = self.get_upcase_table()
+
         # start from root
         fileref = 5
+        seq_number = None
         path = path
         for i, current in enumerate(path):
-            log.debug('we search for: {}'.format(current))
+            log.debug('we search for: %s', current)
+
+            # seen already? (also remembers names that are not there)
+            key = (fileref, seq_number, ignore_case, indexes.filename_key(current, upcase) if ignore_case else current)
+
+            child = self._dentries.get(key, _MISSING)
+            if child is not _MISSING:
+                if child is None:
+                    log.debug('%s is not in #%s (cached), abort', current, fileref)
+                    return None
+
+                fileref, seq_number = child
+                log.debug('we select this entry: 0x%X (#%s), cached', fileref, fileref)
+                continue
+
+            root = self.get_file_record(fileref, seq_number, lazy=True)
+            if root is None:
+                log.debug('file record #%s not found, abort', fileref)
+                return None
 
-            root = self.get_file_record(fileref)
+            reparse = root.get_attribute('$REPARSE_POINT')
+            indexs = root.get_attribute('$INDEX_ROOT')
 
-            if "$REPARSE_POINT" in root.attributes_dict:
-                log.debug('reparse point: {}'.format(root.get_displayed_filename()))
+            if reparse:
+                log.debug('reparse point: %s', root.get_displayed_filename())
 
-                symlink = root.attributes_dict['$REPARSE_POINT'][0].substitute_path
-                log.debug('symlink: {}'.format(symlink))
+                symlink = reparse[0].substitute_path
+                log.debug('symlink: %s', symlink)
 
                 # get rid of windows stuff
                 symlink = symlink[7:]
-                log.debug('resolved path: {}'.format(symlink + '\\' + current))
+                log.debug('resolved path: %s', symlink + '\\' + current)
 
                 # search in symlink target
-                fo = self.get_filerecord_of_path(symlink + '\\' + current)
-                if fo:
-                    fileref = fo.inode
-                else:
-                    log.debug('not found, abort')
-                    return None
+                fo = self.get_filerecord_of_path(symlink + '\\' + current, ignore_case)
 
-                continue
+                child = None
+                if fo:
+                    child = (fo.inode, fo.seq_number)
 
-            if '$INDEX_ROOT' in root.attributes_dict:
+            elif indexs:
                 # can we have more than one $INDEX_ROOT ?
 
-                entries = root.attributes_dict['$INDEX_ROOT'][0].entries
-                for entry in entries:
-                    log.debug('entry: {}'.format(entry.filename))
-
-                    if current == entry.filename:
-                        fileref = entry.file_reference.record_number
-                        log.debug('we select this entry: 0x{:X} (#{})'.format(fileref, fileref))
+                entry = None
+                for index in indexs:
+                    entry = index.find(current, upcase, ignore_case)
+                    if entry is not None:
                         break
 
+                child = None
+                if entry is not None:
+                    child = (entry.file_reference.record_number, entry.file_reference.seq_number)
 
             else:
                 log.debug('No index_root, no reparse ... nothing to do ...')
                 break
-                        
+
+            self._dentries.put(key, child)
+
+            if child is None:
+                log.debug('%s not found in #%s, abort', current, fileref)
+                return None
+
+            fileref, seq_number = child
+            log.debug('we select this entry: 0x%X (#%s)', fileref, fileref)
 
         # last file reference
-        root = self.get_file_record(fileref)
+        root = self.get_file_record(fileref, seq_number, lazy=True)
+        if root is None:
+            log.debug('file not found.')
+            return None
+
         filenames = root.get_file_names()
         if filenames is None:
             log.debug('file not found.')
@@ -634,10 +1019,13 @@ class MFT(object):
 
         filenames = [name for name, namespace in filenames]
 
+        if ignore_case:
+            current = indexes.filename_key(current, upcase)
+            filenames = [indexes.filename_key(name, upcase) for name in filenames]
+
         if current in filenames:
             if root._has_reparse_point():
-                symlink = root.get_reparse_point()
-                root = self.get_filerecord_of_path(symlink)
+                root = self._resolve_symlink(root, ignore_case)
 
 
             log.debug('file found.')
@@ -1,15 +1,26 @@
+import hashlib
 import logging
 
 from . import helper
+from . import bitmap
 from . import DataModel
 from . import mft
+from . import snapshot
+from . import clustermap
+from . import treewalk
+
+# file records hashed into the volume fingerprint, the system files ($MFT, $MFTMirr, $LogFile, ...)
+FINGERPRINT_RECORDS = 16
+
+# $Bitmap file record, one bit per cluster of the volume
+VOLUME_BITMAP_RECORD = 6
 
 class Boot(object):
     def __init__(self):
         pass
 
 class NTFS(object):
-    def __init__(self, dataModel):
+    def __init__(self, dataModel, snapshot_file=None):
         self.dataModel = dataModel
 
         if self.dataModel.size() < 512:
@@ -21,14 +32,159 @@ class NTFS(object):
         self.boot.sectors_per_cluster     = self.dataModel.getBYTE(0x0D)
         self.boot.bytes_per_sector        = self.dataModel.getWORD(0x0B)
         self.boot.clusters_per_mft_record = self.dataModel.getDWORD(0x40)
+        self.boot.serial_number           = self.dataModel.getQWORD(0x48)
+        self.boot.total_sectors           = self.dataModel.getQWORD(0x28)
+
+        self.bytes_per_cluster = self.boot.sectors_per_cluster * self.boot.bytes_per_sector
+        self.total_clusters = self.boot.total_sectors // self.boot.sectors_per_cluster if self.boot.sectors_per_cluster else 0
+
+        # $Bitmap, see get_volume_bitmap()
+        self._volume_bitmap = None
+
+        # LCN -> owner, see get_cluster_map()
+        self._cluster_map = None
+
+        # $MFT runlist and $AttrDef are read on first use of self.mft
+        self._mft = mft.MFT(self.boot, dataModel)
+        self._mft_built = False
+
+        self.snapshot = None
+        if snapshot_file is not None:
+            self.load_snapshot(snapshot_file)
+
+    @property
+    def mft(self):
+        if not self._mft_built:
+            # build MFT
+            self._mft._get_mft_data_runs()
+
+            # get $AttrDef
+            self._mft._build_attrdef()
+
+            self._mft_built = True
+
+        return self._mft
+
+    def get_volume_bitmap(self):
+        # $Bitmap as a bitmap.Bitset over total_clusters bits, bit k is set if cluster k
+        # is allocated. read once, streamed through $DATA
+        if self._volume_bitmap is None:
+            fr = self.mft.get_file_record(VOLUME_BITMAP_RECORD, lazy=True)
+            if fr is None or not fr.get_attribute('$DATA'):
+                raise NtfsError('$Bitmap not found')
+
+            data = b''.join(bytes(chunk) for chunk in fr.get_file_data())
+            self._volume_bitmap = bitmap.Bitset(data, self.total_clusters)
+
+        return self._volume_bitmap
+
+    def is_cluster_allocated(self, lcn):
+        return self.get_volume_bitmap()[lcn]
+
+    def cluster_extents(self, allocated=True, start=0, end=None):
+        # coalesced (lcn, n_clusters) ranges of allocated (or free) clusters in [start, end)
+        return self.get_volume_bitmap().extents(allocated, start, end)
+
+    def count_clusters(self, allocated=True, start=0, end=None):
+        # allocated (or free) clusters in [start, end)
+        bits = self.get_volume_bitmap()
+
+        if end is None or end > bits.size:
+            end = bits.size
+
+        used = bits.count(start, end)
+        if allocated:
+            return used
+
+        return max(0, end - start) - used
+
+    def cluster_stats(self):
+        bits = self.get_volume_bitmap()
+        allocated = bits.count()
+
+        return {'bytes_per_cluster': self.bytes_per_cluster,
+                'clusters': bits.size,
+                'allocated': allocated,
+                'free': bits.size - allocated,
+                'free_bytes': (bits.size - allocated) * self.bytes_per_cluster}
+
+    def get_cluster_map(self, jobs=1):
+        # clustermap.ClusterMap of the records in use, built by one $MFT scan, kept
+        if self._cluster_map is None:
+            self._cluster_map = clustermap.ClusterMap.from_mft(self.mft, jobs=jobs)
+
+        return self._cluster_map
+
+    def owner_of_offset(self, offset):
+        # which file record, attribute, stream and VCN hold this byte of the volume
+        return self.get_cluster_map().owner_of_offset(offset)
+
+    def fingerprint(self):
+        # (serial number, sha1 of the first file records). $MFT and $MFTMirr records hold
+        # the $MFT runlist and size, so this is enough to tell two images apart, and it only
+        # needs the boot sector geometry.
+        file_record_size = self._mft.file_record_size
+        start_mft = self.boot.lcn_of_mft * self.boot.sectors_per_cluster * self.boot.bytes_per_sector
+
+        records = self.dataModel.getStream(start_mft, start_mft + FINGERPRINT_RECORDS * file_record_size)
+
+        return self.boot.serial_number, hashlib.sha1(records).digest()
+
+    def load_snapshot(self, filename):
+        # use a snapshot written by save_snapshot(), only if it was taken from this volume
+        log = helper.Helper.logger()
+
+        try:
+            snap = snapshot.Snapshot(filename)
+        except (OSError, NtfsError) as e:
+            log.debug('snapshot %s not loaded: %s', filename, e)
+            return False
+
+        if snap.fingerprint != self.fingerprint():
+            log.debug('snapshot %s was taken from another volume.', filename)
+            snap.close()
+            return False
+
+        self.snapshot = snap
+        return True
+
+    def save_snapshot(self, filename, jobs=1):
+        # full $MFT scan, then the snapshot is written and loaded
+        snapshot.write_snapshot(self, filename, jobs=jobs)
+        return self.load_snapshot(filename)
+
+    def get_filerecord_of_path(self, path, ignore_case=False):
+        # the snapshot answers exact paths with one (lazy) record read, otherwise directories are walked
+        if self.snapshot is not None and not ignore_case:
+            entry = self.snapshot.find_path(path)
+            if entry is not None:
+                file_record = self.mft.get_file_record(entry.inode, entry.seq_number, lazy=True)
+
+                # symlinks resolve the same as in a directory walk
+                if file_record is not None and file_record._has_reparse_point():
+                    file_record = self.mft._resolve_symlink(file_record, ignore_case)
+
+                return file_record
+
+        return self.mft.get_filerecord_of_path(path, ignore_case)
+
+    def walk(self, top='', jobs=1, max_in_flight=None, ignore_case=False):
+        # os.walk() like generator over the directory tree under top, see treewalk.walk()
+        top = top.strip('\\')
+
+        if top:
+            fr = self.get_filerecord_of_path(top, ignore_case)
+        else:
+            fr = self.mft.get_file_record(5, lazy=True)
 
-        self.mft = mft.MFT(self.boot, dataModel)
+        if fr is None:
+            return iter(())
 
-        # build MFT
-        self.mft._get_mft_data_runs()
+        return treewalk.walk(self.mft, fr, top, jobs=jobs, max_in_flight=max_in_flight)
 
-        # get $AttrDef
-        self.mft._build_attrdef()
+    def stat(self, path, ignore_case=False):
+        # see MFT.stat()
+        return self.mft.stat(path, ignore_case)
 
     @staticmethod
     def fixup_seq_numbers(data, update_seq_array, size_update_seq, update_seq, bytes_per_sector):
@@ -51,7 +207,7 @@ class NTFS(object):
 
             fixup = fixup_array.getWORD(i * 2)
 
-            log.debug('\tlast two bytes of sector: {:04x}, fixup {:04x}'.format(seq, fixup))
+            log.debug('\tlast two bytes of sector: %04x, fixup %04x', seq, fixup)
 
             if seq != update_seq:
                 log.warning('\tupdate sequence check failed, image may be corrupt, continue anyway')
@@ -0,0 +1,118 @@
+from . import helper
+
+# orphans (parent deleted, slot reused, or a loop) are listed under this directory
+ORPHAN_DIR = '$OrphanFiles'
+
+def _path_entry(file_record):
+    # runs in the scan workers: record, seq number, parent record, parent seq number, name
+    if file_record.file_reference.record_number != 0:
+        # extension record
+        return None
+
+    filename = file_record.get_displayed_filename_attribute()
+    if filename is None:
+        return None
+
+    parent = filename.parent_reference
+    return file_record.inode, file_record.seq_number, parent.record_number, parent.seq_number, filename.attr_filename
+
+class PathTable(object):
+    # record -> full path, resolved bottom-up from the $FILE_NAME parent references.
+    # every parent chain is walked once, resolved prefixes are memoized.
+    def __init__(self):
+        self._names = {}
+        self._paths = {5: ''}
+
+        self.orphans = set()
+
+    @classmethod
+    def from_mft(cls, mft, jobs=1, allocated=None):
+        # one sequential (or parallel) pass over the $MFT, no directory is read.
+        # allocated selects the records, see MFT.iter_file_records()
+        table = cls()
+
+        for entry in mft.map_file_records(_path_entry, jobs=jobs, lazy=True, allocated=allocated):
+            if entry is not None:
+                table.add(*entry)
+
+        return table
+
+    def add(self, inode, seq_number, parent, parent_seq, name):
+        self._names[inode] = (seq_number, parent, parent_seq, name)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, inode):
+        return inode in self._names
+
+    def __iter__(self):
+        # (record, path), in record order
+        for inode in sorted(self._names):
+            yield inode, self.path(inode)
+
+    def name(self, inode):
+        entry = self._names.get(inode)
+        if entry is None:
+            return None
+
+        return entry[3]
+
+    def _valid_parent(self, parent, parent_seq):
+        entry = self._names.get(parent)
+        if entry is None:
+            return parent == 5
+
+        # seq number 0 means unknown
+        return not parent_seq or entry[0] == parent_seq
+
+    def path(self, inode):
+        # path relative to the root directory, None for records not in the table
+        path = self._paths.get(inode)
+        if path is not None:
+            return path
+
+        if inode not in self._names:
+            return None
+
+        chain = []
+        seen = set()
+
+        k = inode
+        orphan = False
+
+        while k not in self._paths:
+            if k in seen:
+                # parent loop
+                orphan = True
+                break
+
+            seen.add(k)
+            chain.append(k)
+
+            seq_number, parent, parent_seq, name = self._names[k]
+            if not self._valid_parent(parent, parent_seq):
+                orphan = True
+                break
+
+            k = parent
+
+        if orphan:
+            log = helper.Helper.logger()
+            log.debug('orphan file record #%s', chain[-1])
+
+            self.orphans.add(chain[-1])
+            path = ORPHAN_DIR
+        else:
+            path = self._paths[k]
+
+        for k in reversed(chain):
+            name = self._names[k][3]
+            path = name if path == '' else path + '\\' + name
+            self._paths[k] = path
+
+        return path
+
+    def is_orphan(self, inode):
+        path = self.path(inode)
+        return path is not None and path.startswith(ORPHAN_DIR + '\\')
@@ -0,0 +1,69 @@
+import bisect
+
+class RunList(object):
+    # data runs of a non-resident attribute, (n_clusters, lcn) pairs.
+    # the starting VCN of every run is computed once, so lookups are binary searches
+    # instead of walking the whole list (fragmented $MFT and indexes have thousands of runs).
+    def __init__(self, data_runs=(), start_vcn=0):
+        self._runs = list(data_runs)
+        self._vcns = []
+
+        vcn = start_vcn
+        for n, lcn in self._runs:
+            self._vcns.append(vcn)
+            vcn += n
+
+        self.start_vcn = start_vcn
+        self.clusters = vcn - start_vcn
+
+    def __iter__(self):
+        return iter(self._runs)
+
+    def __len__(self):
+        return len(self._runs)
+
+    def __getitem__(self, k):
+        return self._runs[k]
+
+    def __repr__(self):
+        return 'RunList({!r}, start_vcn={})'.format(self._runs, self.start_vcn)
+
+    def vcn_of_run(self, k):
+        # first VCN of the k-th run
+        return self._vcns[k]
+
+    def find_vcn(self, vcn):
+        # returns ((n, lcn), vcn relative to that run), or None if vcn is not mapped
+        k = bisect.bisect_right(self._vcns, vcn) - 1
+        if k < 0:
+            return None
+
+        n, lcn = self._runs[k]
+
+        rel_vcn = vcn - self._vcns[k]
+        if rel_vcn >= n:
+            return None
+
+        return self._runs[k], rel_vcn
+
+    def lcn_of_vcn(self, vcn):
+        # None if vcn is not mapped or falls in a hole (sparse run)
+        found = self.find_vcn(vcn)
+        if found is None:
+            return None
+
+        (n, lcn), rel_vcn = found
+        if lcn is None:
+            return None
+
+        return lcn + rel_vcn
+
+    def offset_of(self, offset, bytes_per_cluster):
+        # byte offset inside the attribute -> byte offset on the volume, None for holes
+        vcn, rel = divmod(offset, bytes_per_cluster)
+
+        lcn = self.lcn_of_vcn(vcn)
+        if lcn is None:
+            return None
+
+        return lcn * bytes_per_cluster + rel
@@ -0,0 +1,253 @@
+import collections
+import mmap
+import os
+import struct
+
+from . import helper
+from . import pathtable
+from . import runlist
+from . import ntfs
+
+# persistent index of the $MFT, written after a full scan and memory mapped on later opens.
+#
+#   header
+#   records   one fixed size entry per $MFT slot, entry k is file record #k
+#   runs      (n_clusters, lcn) of the unnamed $DATA stream, lcn -1 for sparse runs
+#   strings   utf-8 names and paths, orphans are under pathtable.ORPHAN_DIR
+#   paths     record numbers of in use, not orphaned records, sorted by path
+
+SNAPSHOT_MAGIC   = b'FSNTFSIX'
+SNAPSHOT_VERSION = 2
+
+# magic, version, record entry size, serial number, sha1 of the first file records,
+# number of records, offsets of records, runs, strings and paths, number of paths
+SNAPSHOT_HEADER = struct.Struct('<8sIIQ20sQQQQQQ')
+
+# present (SNAPSHOT_PRESENT, SNAPSHOT_EXTENSION), seq, flags, parent reference, real size, allocated size,
+# name offset/length, path offset/length, first run/count
+SNAPSHOT_RECORD = struct.Struct('<BxHHQQQQIQIQI')
+
+SNAPSHOT_RUN  = struct.Struct('<Qq')
+SNAPSHOT_PATH = struct.Struct('<Q')
+
+SNAPSHOT_PRESENT   = 0x01
+SNAPSHOT_EXTENSION = 0x02
+
+FILE_RECORD_IN_USE = 0x01
+
+# extension records are listed too (no name, no path, no runs), as a $MFT scan lists them
+SnapshotEntry = collections.namedtuple('SnapshotEntry', 'inode seq_number flags parent name path real_size allocated_size data_runs extension')
+
+def _snapshot_entry(file_record):
+    # runs in the scan workers, everything the snapshot needs from one file record
+    if file_record.file_reference.record_number != 0:
+        # extension record, its attributes are reached through the base record
+        return (file_record.inode, file_record.seq_number, file_record.flags, 0, None, 0, 0, [], True)
+
+    name = None
+    parent = 0
+
+    filename = file_record.get_displayed_filename_attribute()
+    if filename is not None:
+        name = filename.attr_filename
+        parent = filename.parent_reference.seq_number << 48 | filename.parent_reference.record_number
+
+    real_size = 0
+    allocated_size = 0
+    runs = []
+
+    datas = file_record.get_file_streams().get('')
+    if datas:
+        datas.sort(key=lambda x: getattr(x.attribute.std_header, 'start_vcn', 0))
+
+        header = datas[0].attribute.std_header
+        real_size = header.attr_real_size
+        allocated_size = getattr(header, 'attr_allocated_size', real_size)
+
+        for data in datas:
+            if data.attribute.std_header.non_resident_flag:
+                runs += list(data.attribute.data_runs)
+
+    return (file_record.inode, file_record.seq_number, file_record.flags, parent, name, real_size, allocated_size, runs, False)
+
+def write_snapshot(volume, filename, jobs=1):
+    # full scan of volume.mft, written to filename (atomically replaced)
+    log = helper.Helper.logger()
+
+    mft = volume.mft
+    n_records = mft.mft_size // mft.file_record_size
+
+    entries = {}
+    for entry in mft.map_file_records(_snapshot_entry, jobs=jobs, lazy=True):
+        if entry is not None:
+            entries[entry[0]] = entry
+
+    log.debug('snapshot: %s file records out of %s', len(entries), n_records)
+
+    paths = pathtable.PathTable()
+    for inode, entry in entries.items():
+        if entry[4] is not None:
+            paths.add(inode, entry[1], entry[3] & 0x0000FFFFFFFFFFFF, entry[3] >> 48, entry[4])
+
+    records = bytearray(n_records * SNAPSHOT_RECORD.size)
+    runs = bytearray()
+    strings = bytearray()
+    sorted_paths = []
+
+    def add_string(s):
+        if s is None:
+            return 0, 0
+
+        b = s.encode('utf-8', 'surrogatepass')
+        offset = len(strings)
+        strings.extend(b)
+        return offset, len(b)
+
+    for inode, (_, seq_number, flags, parent, name, real_size, allocated_size, data_runs, extension) in entries.items():
+        if inode >= n_records:
+            continue
+
+        name_off, name_len = add_string(name)
+
+        path = paths.path(inode)
+        path_off, path_len = add_string(path)
+
+        runs_off = len(runs) // SNAPSHOT_RUN.size
+        for n, lcn in data_runs:
+            runs += SNAPSHOT_RUN.pack(n, -1 if lcn is None else lcn)
+
+        present = SNAPSHOT_PRESENT | (SNAPSHOT_EXTENSION if extension else 0)
+
+        SNAPSHOT_RECORD.pack_into(records, inode * SNAPSHOT_RECORD.size, present, seq_number, flags, parent,
+                                  real_size, allocated_size, name_off, name_len, path_off, path_len,
+                                  runs_off, len(data_runs))
+
+        if path is not None and flags & FILE_RECORD_IN_USE and not paths.is_orphan(inode):
+            sorted_paths.append((strings[path_off:path_off + path_len], inode))
+
+    sorted_paths.sort()
+
+    serial_number, mft_hash = volume.fingerprint()
+
+    records_off = SNAPSHOT_HEADER.size
+    runs_off = records_off + len(records)
+    strings_off = runs_off + len(runs)
+    paths_off = strings_off + len(strings)
+
+    header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, SNAPSHOT_RECORD.size, serial_number, mft_hash,
+                                  n_records, records_off, runs_off, strings_off, paths_off, len(sorted_paths))
+
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as fo:
+        fo.write(header)
+        fo.write(records)
+        fo.write(runs)
+        fo.write(strings)
+        fo.write(b''.join(SNAPSHOT_PATH.pack(inode) for path, inode in sorted_paths))
+
+    os.replace(tmp, filename)
+
+class Snapshot(object):
+    # read only view over a snapshot file, nothing is parsed until asked for
+    def __init__(self, filename):
+        self.filename = filename
+        self._mm = None
+
+        with open(filename, 'rb') as f:
+            # mmap() refuses empty files
+            if os.fstat(f.fileno()).st_size < SNAPSHOT_HEADER.size:
+                raise ntfs.NtfsError('Invalid snapshot file')
+
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, record_size, serial_number, mft_hash, self.n_records,
+         self._records_off, self._runs_off, self._strings_off, self._paths_off, self.n_paths) = SNAPSHOT_HEADER.unpack_from(self._mm, 0)
+
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION or record_size != SNAPSHOT_RECORD.size:
+            self.close()
+            raise ntfs.NtfsError('Invalid snapshot file')
+
+        # sections are back to back, a truncated file would fail later in get() / find_path()
+        if (self._records_off < SNAPSHOT_HEADER.size or
+                self._records_off + self.n_records * SNAPSHOT_RECORD.size > self._runs_off or
+                self._runs_off > self._strings_off or
+                self._strings_off > self._paths_off or
+                self._paths_off + self.n_paths * SNAPSHOT_PATH.size > len(self._mm)):
+            self.close()
+            raise ntfs.NtfsError('Truncated snapshot file')
+
+        self.fingerprint = (serial_number, mft_hash)
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.n_records
+
+    def __iter__(self):
+        # records present in the snapshot, in record order
+        for inode in range(self.n_records):
+            entry = self.get(inode)
+            if entry is not None:
+                yield entry
+
+    def _string(self, offset, length):
+        start = self._strings_off + offset
+        return self._mm[start:start + length].decode('utf-8', 'surrogatepass')
+
+    def get(self, which_file_record):
+        if not 0 <= which_file_record < self.n_records:
+            return None
+
+        (present, seq_number, flags, parent, real_size, allocated_size, name_off, name_len,
+         path_off, path_len, runs_off, runs_count) = SNAPSHOT_RECORD.unpack_from(self._mm, self._records_off + which_file_record * SNAPSHOT_RECORD.size)
+
+        if not present:
+            return None
+
+        name = self._string(name_off, name_len) if name_len else None
+        path = self._string(path_off, path_len) if path_len or which_file_record == 5 else None
+
+        runs = []
+        offset = self._runs_off + runs_off * SNAPSHOT_RUN.size
+        for k in range(runs_count):
+            n, lcn = SNAPSHOT_RUN.unpack_from(self._mm, offset + k * SNAPSHOT_RUN.size)
+            runs.append((n, None if lcn < 0 else lcn))
+
+        return SnapshotEntry(which_file_record, seq_number, flags, parent, name, path,
+                             real_size, allocated_size, runlist.RunList(runs), bool(present & SNAPSHOT_EXTENSION))
+
+    def _path_at(self, k):
+        inode, = SNAPSHOT_PATH.unpack_from(self._mm, self._paths_off + k * SNAPSHOT_PATH.size)
+
+        _, _, _, _, _, _, _, _, path_off, path_len, _, _ = SNAPSHOT_RECORD.unpack_from(self._mm, self._records_off + inode * SNAPSHOT_RECORD.size)
+
+        start = self._strings_off + path_off
+        return self._mm[start:start + path_len], inode
+
+    def find_path(self, path):
+        # binary search over the sorted paths, same form as MFT.get_filerecord_of_path() takes
+        key = path.strip('\\').encode('utf-8', 'surrogatepass')
+
+        lo, hi = 0, self.n_paths
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._path_at(mid)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        if lo < self.n_paths:
+            found, inode = self._path_at(lo)
+            if found == key:
+                return self.get(inode)
+
+        return None
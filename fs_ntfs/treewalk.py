@@ -0,0 +1,111 @@
+import collections
+import concurrent.futures
+
+from . import helper
+
+# directories expanded ahead of the walk, per worker thread
+IN_FLIGHT_PER_JOB = 4
+
+# $FILE_NAME flags, junctions and symlinks to directories are listed but not entered
+FILE_NAME_REPARSE_POINT = 0x400
+
+DirEntries = collections.namedtuple('DirEntries', 'dirs files')
+
+def _expand(mft, inode, seq_number):
+    # one directory: (name, record, seq number) of its sub-directories, names of its files.
+    # runs on the walk threads, reads the record and its INDX blocks
+    fr = mft.get_file_record(inode, seq_number, lazy=True)
+    if fr is None:
+        return DirEntries([], [])
+
+    dirs = []
+    files = []
+
+    for entry in fr.scandir():
+        ref = entry.file_reference
+
+        if entry.is_dir() and ref.record_number not in (5, inode):
+            dirs.append((entry.filename, ref.record_number, ref.seq_number, entry.attr_flags))
+        elif ref.record_number != 5:
+            files.append(entry.filename)
+
+    return DirEntries(dirs, files)
+
+def walk(mft, top_record, top_path='', jobs=1, max_in_flight=None):
+    # os.walk() over the $I30 indexes: (dirpath, dirnames, filenames), top-down, depth first,
+    # names in collation order. dirnames can be pruned in place, like os.walk().
+    #
+    # with jobs > 1 the directories next in the walk are expanded ahead on a thread pool,
+    # at most max_in_flight of them (read or waiting to be yielded), so memory stays bounded
+    # and the order is the same as the serial walk.
+    log = helper.Helper.logger()
+
+    if max_in_flight is None:
+        max_in_flight = IN_FLIGHT_PER_JOB * max(1, jobs)
+
+    # directories still to visit, the next one is at the end
+    stack = [(top_path, top_record.inode, top_record.seq_number)]
+
+    # record -> future, directories being expanded ahead
+    ahead = {}
+
+    seen = set()
+
+    pool = None
+    if jobs > 1:
+        pool = concurrent.futures.ThreadPoolExecutor(jobs)
+
+    try:
+        while stack:
+            path, inode, seq_number = stack.pop()
+
+            if inode in seen:
+                log.warning('directory #%s reached twice, skipped.', inode)
+
+                # it may have been expanded ahead, give back its slot
+                future = ahead.pop(inode, None)
+                if future is not None:
+                    future.cancel()
+
+                continue
+
+            seen.add(inode)
+
+            future = ahead.pop(inode, None)
+            if future is not None:
+                entries = future.result()
+            else:
+                entries = _expand(mft, inode, seq_number)
+
+            dirnames = [name for name, _, _, _ in entries.dirs]
+            yield path, dirnames, entries.files
+
+            # the caller may have pruned dirnames
+            wanted = set(dirnames)
+
+            children = []
+            for name, child, child_seq, attr_flags in entries.dirs:
+                if name not in wanted or attr_flags & FILE_NAME_REPARSE_POINT:
+                    continue
+
+                children.append((path + '\\' + name if path else name, child, child_seq))
+
+            # first child on top
+            stack.extend(reversed(children))
+
+            if pool is None:
+                continue
+
+            # expand the directories the walk gets to next
+            for _, child, child_seq in reversed(stack):
+                if len(ahead) >= max_in_flight:
+                    break
+
+                if child not in ahead and child not in seen:
+                    ahead[child] = pool.submit(_expand, mft, child, child_seq)
+    finally:
+        if pool is not None:
+            for future in ahead.values():
+                future.cancel()
+
+            pool.shutdown(wait=True)
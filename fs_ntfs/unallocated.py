@@ -0,0 +1,150 @@
+import bisect
+import os
+
+from . import helper
+
+# biggest single read of the export, free extents are read in pieces of this size
+EXPORT_CHUNK_SIZE = 16 * 1024 * 1024
+
+# header of the offset map written next to an export
+OFFSET_MAP_HEADER = 'output_offset,lcn,clusters,volume_offset'
+
+def iter_unallocated(volume, chunk_size=EXPORT_CHUNK_SIZE, start=0, end=None):
+    # unallocated clusters of volume (an NTFS) in LCN order, as (lcn, data) chunks.
+    # $Bitmap extents are already coalesced, each one is read sequentially in chunks
+    # of up to chunk_size bytes (rounded down to whole clusters)
+    log = helper.Helper.logger()
+
+    bytes_per_cluster = volume.bytes_per_cluster
+    clusters_per_chunk = max(1, chunk_size // bytes_per_cluster)
+
+    for lcn, n in volume.cluster_extents(allocated=False, start=start, end=end):
+        log.debug('unallocated: 0x%x clusters @ LCN 0x%x', n, lcn)
+
+        while n > 0:
+            count = min(n, clusters_per_chunk)
+
+            offset = lcn * bytes_per_cluster
+            data = volume.dataModel.getStream(offset, offset + count * bytes_per_cluster)
+
+            if len(data) == 0:
+                # image is shorter than the volume
+                log.debug('unallocated: LCN 0x%x is past the end of the image', lcn)
+                return
+
+            yield lcn, data
+
+            lcn += count
+            n -= count
+
+def export_unallocated(volume, fo, offset_map=None, chunk_size=EXPORT_CHUNK_SIZE, start=0, end=None):
+    # all unallocated clusters written back to back to fo. offset_map (text file) gets one
+    # line per extent, see OffsetMap. returns the number of bytes written
+    bytes_per_cluster = volume.bytes_per_cluster
+
+    if offset_map is not None:
+        offset_map.write(OFFSET_MAP_HEADER + '\n')
+
+    written = 0
+
+    # current extent of the map, (output offset, lcn, clusters)
+    extent = None
+
+    for lcn, data in iter_unallocated(volume, chunk_size, start, end):
+        fo.write(data)
+
+        clusters = (len(data) + bytes_per_cluster - 1) // bytes_per_cluster
+
+        if extent is not None and extent[1] + extent[2] == lcn:
+            # next chunk of the same extent
+            extent = (extent[0], extent[1], extent[2] + clusters)
+        else:
+            if extent is not None and offset_map is not None:
+                _write_extent(offset_map, extent, bytes_per_cluster)
+
+            extent = (written, lcn, clusters)
+
+        written += len(data)
+
+    if extent is not None and offset_map is not None:
+        _write_extent(offset_map, extent, bytes_per_cluster)
+
+    return written
+
+def export_unallocated_extents(volume, directory, chunk_size=EXPORT_CHUNK_SIZE, start=0, end=None):
+    # one file per unallocated extent in directory, named after its first LCN.
+    # returns [(filename, lcn, clusters)]
+    bytes_per_cluster = volume.bytes_per_cluster
+
+    files = []
+    fo = None
+
+    for lcn, data in iter_unallocated(volume, chunk_size, start, end):
+        clusters = (len(data) + bytes_per_cluster - 1) // bytes_per_cluster
+
+        if files and files[-1][1] + files[-1][2] == lcn:
+            filename, first, n = files[-1]
+            files[-1] = (filename, first, n + clusters)
+        else:
+            if fo is not None:
+                fo.close()
+
+            filename = os.path.join(directory, 'unallocated_{:012x}.bin'.format(lcn))
+            fo = open(filename, 'wb')
+
+            files.append((filename, lcn, clusters))
+
+        fo.write(data)
+
+    if fo is not None:
+        fo.close()
+
+    return files
+
+def _write_extent(offset_map, extent, bytes_per_cluster):
+    output_offset, lcn, clusters = extent
+    offset_map.write('{},{},{},{}\n'.format(output_offset, lcn, clusters, lcn * bytes_per_cluster))
+
+class OffsetMap(object):
+    # maps offsets of an export_unallocated() output back to clusters of the volume
+    def __init__(self, fo, bytes_per_cluster):
+        self.bytes_per_cluster = bytes_per_cluster
+
+        self._offsets = []
+        self._extents = []
+
+        for line in fo:
+            line = line.strip()
+            if not line or line == OFFSET_MAP_HEADER:
+                continue
+
+            output_offset, lcn, clusters, _ = [int(x) for x in line.split(',')]
+
+            self._offsets.append(output_offset)
+            self._extents.append((lcn, clusters))
+
+    def __len__(self):
+        return len(self._extents)
+
+    def lcn_of(self, output_offset):
+        # (lcn, offset inside that cluster) of a byte of the export, None if out of range
+        k = bisect.bisect_right(self._offsets, output_offset) - 1
+        if k < 0:
+            return None
+
+        lcn, clusters = self._extents[k]
+
+        rel_cluster, rel = divmod(output_offset - self._offsets[k], self.bytes_per_cluster)
+        if rel_cluster >= clusters:
+            return None
+
+        return lcn + rel_cluster, rel
+
+    def volume_offset_of(self, output_offset):
+        # byte offset in the volume of a byte of the export
+        found = self.lcn_of(output_offset)
+        if found is None:
+            return None
+
+        lcn, rel = found
+        return lcn * self.bytes_per_cluster + rel
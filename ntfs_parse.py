@@ -1,8 +1,12 @@
 import sys
 import logging
 import argparse
+import datetime
 
 import fs_ntfs.ntfs
+import fs_ntfs.helper
+import fs_ntfs.filerecord
+import fs_ntfs.unallocated
 import fs_ntfs.DataModel
 
 
@@ -11,10 +15,21 @@ def arg_options():
     usage = """Usage: ntfs_parse.py \\\\.\\c: -f 0 --fetch-file
        ntfs_parse.py \\\\.\\c: -s $MFT --fetch-file
        ntfs_parse.py \\\\.\\c: -s $MFTMirr
+       ntfs_parse.py \\\\.\\c: -s windows\\system32\\NOTEPAD.EXE -i --fetch-file
        ntfs_parse.py \\\\.\\c: -s C:\pagefile.sys --fetch-file
        ntfs_parse.py \\\\.\\c: -s "Documents and Settings\\All Users\\Application Data\\Start Menu\\desktop.ini" --fetch-file
            note: ?:\ and quotes will be skipped.
        ntfs_parse.py ntfs_image -f 123 --fetch-file
+       ntfs_parse.py ntfs_image -a --jobs 8 -q
+       ntfs_parse.py ntfs_image -a --index ntfs_image.idx -q
+       ntfs_parse.py ntfs_image -p --jobs 8 -q
+       ntfs_parse.py ntfs_image -a --records free -q
+       ntfs_parse.py ntfs_image -b -q
+       ntfs_parse.py ntfs_image -u ntfs_image.free -q
+       ntfs_parse.py ntfs_image -o 0x1f4000 0x2a1000 --jobs 8 -q
+       ntfs_parse.py ntfs_image -t "Windows\\notepad.exe" -q
+       ntfs_parse.py ntfs_image -W Windows --jobs 16 -q
+       ntfs_parse.py ntfs_image -s "Windows\\notepad.exe" --index ntfs_image.idx
        """
 
     parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, epilog=usage)
@@ -24,9 +39,20 @@ def arg_options():
     group.add_argument("-f", "--filerecord", help="Dump info for file record number.", type=int)
     group.add_argument("-s", "--search", help="Search path. Will dump all info traversing directories.")
     group.add_argument("-r", "--reparse", help="Dump $Reparse file data.", action='store_true')
+    group.add_argument("-a", "--all", help="Scan the whole $MFT, dump one line per file record.", action='store_true')
+    group.add_argument("-b", "--bitmap", help="Dump cluster usage from $Bitmap, then the free cluster ranges.", action='store_true')
+    group.add_argument("-p", "--paths", help="Scan the whole $MFT, dump the full path of every file record.", action='store_true')
+    group.add_argument("-u", "--unallocated", help="Export all free clusters to this file, with an offset map (FILE.map) back to LCNs.")
+    group.add_argument("-W", "--walk", help="Walk the directory tree under this path ('' for the root), dump every path. Uses --jobs threads.", nargs='?', const='')
+    group.add_argument("-t", "--stat", help="Dump size, flags and times of a path, from its parent directory index.")
+    group.add_argument("-o", "--owner", help="Volume byte offsets, dump the file record, attribute, stream and VCN owning each one.", type=lambda x: int(x, 0), nargs='+')
 
     parser.add_argument("-w", "--fetch-file", help="Fetch all file's streams.", action="store_true")
+    parser.add_argument("-i", "--ignore-case", help="Case insensitive path search, like windows.", action="store_true")
     parser.add_argument("-l", "--list", help="List files, specify recursion depth (default is 2). Give -1 for a full recursion.", type=int, nargs='?', const=2)
+    parser.add_argument("-j", "--jobs", help="Worker processes used to scan the $MFT, or threads used by -W (default is 1).", type=int, default=1)
+    parser.add_argument("--records", help="File records scanned by -a and -p: all of them, only the ones in use, or only the free ones (default is all).", choices=['all', 'used', 'free'], default='all')
+    parser.add_argument("-x", "--index", help="$MFT snapshot file. Used for path lookups and -a if it matches the image, written by -a otherwise.")
 
     group1 = parser.add_mutually_exclusive_group()
     group1.add_argument("-q", "--quiet", help="No logging.", action="store_true")
@@ -49,7 +75,10 @@ def save_it(fr):
     filename = fr.get_displayed_filename()
 
     streams = fr.get_file_streams()
-    
+
+    # one buffer for all streams
+    buffer = bytearray(fs_ntfs.filerecord.FETCH_CHUNK_SIZE)
+
     for s in streams:
         save_filename = filename
         display_filename = filename
@@ -60,7 +89,7 @@ def save_it(fr):
         fo = open(save_filename, 'wb+')
         print('fetching file "{}", size {:,} bytes...'.format(display_filename, fr.get_file_size(stream=s)))
 
-        fr.fetch_file(fo, stream=s)
+        fr.fetch_file(fo, stream=s, buffer=buffer)
         fo.close()
 
 def print_dir(dirs, delim='  '):
@@ -91,6 +120,119 @@ def dump_reparse(mft):
             print('#{:<10} {:<40} -> {}'.format(record, symlink, reparse))
             A[record] = 0
 
+def record_summary(fr):
+    # runs in the worker processes, must return something picklable
+    return fr.inode, fr.flags, fr.get_displayed_filename()
+
+# --records -> allocated argument of the $MFT scans
+SCAN_RECORDS = {'all': None, 'used': True, 'free': False}
+
+def dump_all(ntfs, jobs, allocated=None):
+    print('{:<11} {:<6} {}'.format('file record', 'flags', 'name'))
+    print('')
+
+    if ntfs.snapshot is not None and allocated is None:
+        # no need to touch the $MFT
+        summary = ((entry.inode, entry.flags, entry.name) for entry in ntfs.snapshot)
+    else:
+        summary = ntfs.mft.map_file_records(record_summary, jobs=jobs, allocated=allocated)
+
+    for record, flags, name in summary:
+        print('#{:<10} 0x{:04x} {}'.format(record, flags, name))
+
+def dump_paths(mft, jobs, allocated=None):
+    table = mft.get_path_table(jobs=jobs, allocated=allocated)
+
+    print('{:<11} {}'.format('file record', 'path'))
+    print('')
+
+    for record, path in table:
+        print('#{:<10} \\{}'.format(record, path))
+
+    print('')
+    print('{} file records, {} orphans.'.format(len(table), len(table.orphans)))
+
+def dump_bitmap(ntfs):
+    stats = ntfs.cluster_stats()
+
+    print('clusters: {:,}, {} bytes each'.format(stats['clusters'], stats['bytes_per_cluster']))
+    print('allocated: {:,}'.format(stats['allocated']))
+    print('free: {:,} ({:,} bytes)'.format(stats['free'], stats['free_bytes']))
+    print('')
+
+    print('{:<18} {}'.format('free LCN', 'clusters'))
+    for lcn, n in ntfs.cluster_extents(allocated=False):
+        print('0x{:<16x} {}'.format(lcn, n))
+
+def dump_unallocated(ntfs, filename):
+    map_filename = filename + '.map'
+
+    print('exporting free clusters to "{}", offset map "{}"...'.format(filename, map_filename))
+
+    with open(filename, 'wb') as fo, open(map_filename, 'w') as fmap:
+        written = fs_ntfs.unallocated.export_unallocated(ntfs, fo, offset_map=fmap)
+
+    print('{:,} bytes written.'.format(written))
+
+def format_filetime(filetime):
+    try:
+        return datetime.datetime.fromtimestamp(fs_ntfs.helper.Helper.filetime_to_unix(filetime), datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    except (OverflowError, OSError, ValueError):
+        return '0x{:x}'.format(filetime)
+
+def dump_walk(ntfs, top, jobs, ignore_case):
+    dirs = 0
+    files = 0
+
+    for dirpath, dirnames, filenames in ntfs.walk(top.strip('"'), jobs=jobs, ignore_case=ignore_case):
+        prefix = '\\' + dirpath + '\\' if dirpath else '\\'
+
+        for name in dirnames:
+            print(prefix + name + '\\')
+
+        for name in filenames:
+            print(prefix + name)
+
+        dirs += len(dirnames)
+        files += len(filenames)
+
+    print('')
+    print('{} directories, {} files.'.format(dirs, files))
+
+def dump_stat(ntfs, path, ignore_case):
+    st = ntfs.stat(path.strip('"'), ignore_case=ignore_case)
+    if st is None:
+        print('file was not found.')
+        return
+
+    print('file record: #{} (seq 0x{:x}), parent #{}'.format(st.inode, st.seq_number, st.parent))
+    print('name: {}'.format(st.name))
+    print('type: {}'.format('directory' if st.is_dir else 'file'))
+    print('size: {:,} bytes, {:,} allocated'.format(st.size, st.allocated_size))
+    print('flags: 0x{:08x}'.format(st.attr_flags))
+    print('created: {}'.format(format_filetime(st.creation_time)))
+    print('modified: {}'.format(format_filetime(st.modification_time)))
+    print('mft modified: {}'.format(format_filetime(st.mft_modification_time)))
+    print('accessed: {}'.format(format_filetime(st.access_time)))
+
+def dump_owners(ntfs, offsets, jobs):
+    cmap = ntfs.get_cluster_map(jobs=jobs)
+    paths = ntfs.mft.get_path_table(jobs=jobs, allocated=True)
+
+    print('{:<18} {:<11} {:<18} {:<10} {}'.format('offset', 'file record', 'attribute', 'VCN', 'path'))
+    print('')
+
+    for offset, owner in cmap.owners_of_offsets(offsets):
+        if owner is None:
+            print('0x{:<16x} {}'.format(offset, 'not owned' if ntfs.is_cluster_allocated(offset // ntfs.bytes_per_cluster) else 'free'))
+            continue
+
+        attribute = owner.attribute
+        if owner.stream:
+            attribute += ':' + owner.stream
+
+        print('0x{:<16x} #{:<10} {:<18} 0x{:<8x} \\{}'.format(offset, owner.inode, attribute, owner.vcn, paths.path(owner.inode)))
+
 def main():
     args = arg_options()
 
@@ -98,6 +240,9 @@ def main():
 
     if args.quiet:
         logger.addHandler(logging.NullHandler())
+
+        # do not even build the debug messages
+        fs_ntfs.helper.Helper.set_debug(False)
     else:
         logfile = '!logfile-ntfsparser'
         if args.log_file:
@@ -110,7 +255,11 @@ def main():
 
     image = args.image.strip('"')
     
-    ntfs = fs_ntfs.ntfs.NTFS(fs_ntfs.DataModel.FileDataModel(image))
+    ntfs = fs_ntfs.ntfs.NTFS(fs_ntfs.DataModel.FileDataModel(image), snapshot_file=args.index)
+
+    if args.index and ntfs.snapshot is None and args.all:
+        print('writing $MFT snapshot to "{}"...'.format(args.index))
+        ntfs.save_snapshot(args.index, jobs=args.jobs)
 
     if args.filerecord is not None:
         fr = ntfs.mft.get_file_record(args.filerecord)
@@ -122,7 +271,7 @@ def main():
             if name[1] == ':' and name[2] == '\\':
                 name = name[3:]
 
-        fr = ntfs.mft.get_filerecord_of_path(args.search)
+        fr = ntfs.get_filerecord_of_path(args.search, ignore_case=args.ignore_case)
         if fr is None:
             print('file was not found.')
 
@@ -139,6 +288,27 @@ def main():
     if args.reparse:
         dump_reparse(ntfs.mft)
 
+    if args.all:
+        dump_all(ntfs, args.jobs, SCAN_RECORDS[args.records])
+
+    if args.bitmap:
+        dump_bitmap(ntfs)
+
+    if args.unallocated:
+        dump_unallocated(ntfs, args.unallocated)
+
+    if args.walk is not None:
+        dump_walk(ntfs, args.walk, args.jobs, args.ignore_case)
+
+    if args.stat:
+        dump_stat(ntfs, args.stat, args.ignore_case)
+
+    if args.owner:
+        dump_owners(ntfs, args.owner, args.jobs)
+
+    if args.paths:
+        dump_paths(ntfs.mft, args.jobs, SCAN_RECORDS[args.records])
+
     print('\ndone, see log file.')
     return
 